@@ -33,11 +33,17 @@ __contributors__ = {}
 __url__ = "https://github.com/Alcheri/Plugins.git"
 
 from . import config
+from .local import icmp, monitor, resolver, runtime, stats
 from . import plugin
 from importlib import reload
 
 # In case we're being reloaded.
 reload(config)
+reload(icmp)
+reload(stats)
+reload(monitor)
+reload(resolver)
+reload(runtime)
 reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
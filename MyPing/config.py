@@ -57,5 +57,99 @@ MyPing = conf.registerPlugin("MyPing")
 conf.registerChannelValue(
     MyPing, "enable", registry.Boolean(False, """Should plugin work in this channel?""")
 )
+conf.registerChannelValue(
+    MyPing,
+    "maxTargets",
+    registry.PositiveInteger(
+        8, _("""The most hosts a single ping command may ask for.""")
+    ),
+)
+conf.registerChannelValue(
+    MyPing,
+    "maxCount",
+    registry.PositiveInteger(
+        10, _("""The most probes --count may send to each host.""")
+    ),
+)
+conf.registerGlobalValue(
+    MyPing,
+    "minInterval",
+    registry.PositiveFloat(
+        0.2, _("""The shortest --interval allowed between probes, in seconds.""")
+    ),
+)
+conf.registerGlobalValue(
+    MyPing,
+    "maxInterval",
+    registry.PositiveFloat(
+        60.0, _("""The longest --interval allowed between probes, in seconds.""")
+    ),
+)
+conf.registerGlobalValue(
+    MyPing,
+    "dnsTTL",
+    registry.PositiveInteger(
+        300,
+        _("""Seconds to cache resolved names for, when the records' own
+            TTL is not known (aiodns is not installed)."""),
+    ),
+)
+conf.registerGlobalValue(
+    MyPing,
+    "dnsNegativeTTL",
+    registry.PositiveInteger(
+        60, _("""Seconds to remember that a name has no addresses.""")
+    ),
+)
+conf.registerChannelValue(
+    MyPing,
+    "fanout",
+    registry.PositiveInteger(
+        8,
+        _("""How many hosts of a single ping command are probed at the
+            same time."""),
+    ),
+)
+conf.registerChannelValue(
+    MyPing,
+    "watchlist",
+    registry.SpaceSeparatedListOfStrings(
+        [],
+        _("""Hosts to keep probing in the background for this channel;
+            see the availability and latency commands."""),
+    ),
+)
+conf.registerChannelValue(
+    MyPing,
+    "monitorAnnounce",
+    registry.Boolean(
+        True,
+        _("""Should the channel be told when a host on its watchlist goes
+            down or comes back up?"""),
+    ),
+)
+conf.registerGlobalValue(
+    MyPing,
+    "monitorInterval",
+    registry.PositiveInteger(60, _("""Seconds between probes of each watched host.""")),
+)
+conf.registerGlobalValue(
+    MyPing,
+    "historySize",
+    registry.PositiveInteger(
+        1440,
+        _("""How many probes of each watched host to keep, 16 bytes each.
+            Takes effect on reload."""),
+    ),
+)
+conf.registerGlobalValue(
+    MyPing,
+    "downAfter",
+    registry.PositiveInteger(
+        2,
+        _("""How many probes in a row a watched host must miss before it
+            is reported down. Takes effect on reload."""),
+    ),
+)
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,189 @@
+###
+# Copyright (c) 2016 - 2021, Barry Suridge
+# All rights reserved.
+###
+"""
+In-process ICMP echo probes on an asyncio loop.
+
+One socket per address family serves every probe in flight. Unprivileged
+ICMP datagram sockets are used where the kernel allows them (Linux with
+net.ipv4.ping_group_range covering our group, macOS); otherwise raw
+sockets, which need root or CAP_NET_RAW. When neither can be opened the
+caller falls back to running the system ping.
+"""
+
+import asyncio
+import random
+import socket
+import struct
+import time
+
+ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+PROTOCOL = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+HEADER = struct.Struct("!BBHHH")  # type, code, checksum, identifier, sequence
+PAYLOAD = b"MyPing".ljust(56, b"\x00")
+
+
+class ICMPUnavailable(OSError):
+    """Neither a datagram nor a raw ICMP socket could be opened."""
+
+
+def checksum(data: bytes) -> int:
+    """The RFC 1071 internet checksum of `data`."""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def echo_request(family: int, ident: int, seq: int) -> bytes:
+    """
+    Build an echo request.
+
+    ICMPv6 checksums cover a pseudo-header only the kernel knows, and the
+    kernel fills them in for us; ICMPv4 ones we compute ourselves.
+    """
+    header = HEADER.pack(ECHO_REQUEST[family], 0, 0, ident, seq)
+    if family == socket.AF_INET:
+        header = HEADER.pack(
+            ECHO_REQUEST[family], 0, checksum(header + PAYLOAD), ident, seq
+        )
+    return header + PAYLOAD
+
+
+class _Channel:
+    """One ICMP socket and the probes waiting on it."""
+
+    def __init__(self, family: int):
+        self.family = family
+        try:
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, PROTOCOL[family])
+            self.raw = False
+        except OSError:
+            try:
+                self.sock = socket.socket(family, socket.SOCK_RAW, PROTOCOL[family])
+            except OSError as e:
+                raise ICMPUnavailable(e.errno, e.strerror) from None
+            self.raw = True
+        self.sock.setblocking(False)
+        # Datagram sockets get their identifier from the kernel, which also
+        # hands us only our own replies; raw sockets see every ICMP packet.
+        self.ident = random.getrandbits(16)
+        self._seq = random.getrandbits(16)
+        self.pending = {}  # seq -> (future, address, sent)
+
+    def next_seq(self) -> int:
+        for _ in range(0x10000):
+            self._seq = (self._seq + 1) & 0xFFFF
+            if self._seq not in self.pending:
+                return self._seq
+        raise OSError("Too many ICMP probes in flight")
+
+    def parse(self, data: bytes):
+        """
+        Returns:
+            tuple | None: (identifier, sequence) of an echo reply, else None.
+        """
+        if self.family == socket.AF_INET and data and data[0] >> 4 == 4:
+            # Raw IPv4 sockets deliver the IP header too, and so do macOS
+            # datagram ones; an ICMP message never starts with version 4.
+            data = data[(data[0] & 0x0F) * 4 :]
+        if len(data) < HEADER.size:
+            return None
+        kind, code, _, ident, seq = HEADER.unpack_from(data)
+        if kind != ECHO_REPLY[self.family] or code != 0:
+            return None
+        if self.raw and ident != self.ident:
+            return None
+        return ident, seq
+
+    def close(self):
+        for future, _, _ in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+        self.sock.close()
+
+
+class Prober:
+    """
+    Send ICMP echo requests and match the replies by identifier and
+    sequence number. Create and use it on the event loop only.
+    """
+
+    def __init__(self):
+        self._channels = {}  # family -> _Channel
+        self.sent = 0
+        self.received = 0
+
+    def _channel(self, family: int) -> _Channel:
+        channel = self._channels.get(family)
+        if channel is None:
+            channel = _Channel(family)
+            asyncio.get_running_loop().add_reader(
+                channel.sock.fileno(), self._readable, channel
+            )
+            self._channels[family] = channel
+        return channel
+
+    @property
+    def raw(self) -> bool:
+        """Whether any socket had to fall back to raw mode."""
+        return any(channel.raw for channel in self._channels.values())
+
+    def _readable(self, channel: _Channel):
+        now = time.perf_counter()
+        while True:
+            try:
+                data, source = channel.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. a queued ICMP error on the socket; nothing to match.
+                continue
+            reply = channel.parse(data)
+            if reply is None:
+                continue
+            waiting = channel.pending.get(reply[1])
+            if waiting is None:
+                continue
+            future, address, sent = waiting
+            if source[0].split("%")[0] != address or future.done():
+                continue
+            self.received += 1
+            future.set_result(now - sent)
+
+    async def ping(self, address: str, family: int, timeout: float = 1.0):
+        """
+        Probe one address, which must already be a numeric IP.
+
+        Returns:
+            float | None: Round trip time in seconds, or None on timeout.
+
+        Raises:
+            ICMPUnavailable: No ICMP socket can be opened for this family.
+            OSError: The request could not be sent, e.g. no route to host.
+        """
+        channel = self._channel(family)
+        seq = channel.next_seq()
+        future = asyncio.get_running_loop().create_future()
+        packet = echo_request(family, channel.ident, seq)
+        channel.pending[seq] = (future, address, time.perf_counter())
+        try:
+            channel.sock.sendto(packet, (address, 0))
+            self.sent += 1
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            channel.pending.pop(seq, None)
+
+    def close(self):
+        loop = asyncio.get_running_loop()
+        for channel in self._channels.values():
+            loop.remove_reader(channel.sock.fileno())
+            channel.close()
+        self._channels.clear()
@@ -0,0 +1,90 @@
+###
+# Copyright (c) 2016 - 2021, Barry Suridge
+# All rights reserved.
+###
+"""
+Reachability state and history of the hosts on channel watchlists.
+"""
+
+from .stats import History
+
+UP = "up"
+DOWN = "down"
+
+
+class _Host:
+    __slots__ = ("history", "state", "since", "failures")
+
+    def __init__(self, size: int):
+        self.history = History(size)
+        self.state = None  # not known until the first probes are in
+        self.since = None
+        self.failures = 0
+
+
+class Monitor:
+    """
+    Track watched hosts from their probe results.
+
+    A host goes down after `down_after` lost probes in a row, so a single
+    dropped packet is not reported, and comes back up with the first reply.
+    Each host keeps a History of `size` probes.
+    """
+
+    def __init__(self, size: int = 1440, down_after: int = 2):
+        self.size = size
+        self.down_after = down_after
+        self._hosts = {}  # host -> _Host
+
+    def __contains__(self, host):
+        return host in self._hosts
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def record(self, host: str, when: float, rtt):
+        """
+        Record one probe of `host`, `rtt` None if it was lost.
+
+        Returns:
+            tuple | None: (new state, seconds in the old one) when the host
+                          changed state, else None. The seconds are None
+                          when the old state was not known.
+        """
+        watched = self._hosts.get(host)
+        if watched is None:
+            watched = self._hosts[host] = _Host(self.size)
+        watched.history.add(when, rtt)
+        if rtt is None:
+            watched.failures += 1
+            state = DOWN if watched.failures >= self.down_after else watched.state
+        else:
+            watched.failures = 0
+            state = UP
+        if state == watched.state:
+            return None
+        previous, since = watched.state, watched.since
+        watched.state, watched.since = state, when
+        if previous is None and state == UP:
+            # Coming up for the first time is not news.
+            return None
+        return state, None if since is None else when - since
+
+    def history(self, host: str):
+        watched = self._hosts.get(host)
+        return None if watched is None else watched.history
+
+    def state(self, host: str):
+        """
+        Returns:
+            tuple: (UP, DOWN or None if not known yet, when it started)
+        """
+        watched = self._hosts.get(host)
+        if watched is None:
+            return None, None
+        return watched.state, watched.since
+
+    def prune(self, hosts):
+        """Forget every host not in `hosts`."""
+        for host in set(self._hosts) - set(hosts):
+            del self._hosts[host]
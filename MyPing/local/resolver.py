@@ -0,0 +1,201 @@
+###
+# Copyright (c) 2016 - 2021, Barry Suridge
+# All rights reserved.
+###
+"""
+Non-blocking name resolution with a TTL cache.
+
+With aiodns installed, names are looked up by c-ares on the event loop and
+cached for the TTL of their records. Without it the loop's getaddrinfo
+runs in a thread, and answers are kept for a fixed time instead.
+"""
+
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+
+try:
+    import aiodns  # optional, gives us the records' TTLs
+    from aiodns.error import DNSError
+except ImportError:
+    aiodns = None
+
+# Errors meaning the name has no addresses of a family, as opposed to a
+# lookup that failed and should simply be retried.
+NEGATIVE_ARES = {1, 4}  # ARES_ENODATA, ARES_ENOTFOUND
+NEGATIVE_GAI = {
+    code
+    for code in (
+        getattr(socket, "EAI_NONAME", None),
+        getattr(socket, "EAI_NODATA", None),
+        getattr(socket, "EAI_ADDRFAMILY", None),
+    )
+    if code is not None
+}
+
+
+def literal(host: str):
+    """
+    Returns:
+        tuple | None: (family, address) if `host` is an IP address.
+    """
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    family = socket.AF_INET6 if address.version == 6 else socket.AF_INET
+    return family, str(address)
+
+
+class Resolver:
+    """
+    Resolve host names on the running event loop.
+
+    Answers are cached per (name, family): addresses for their TTL, clamped
+    to [min_ttl, max_ttl], and names without addresses for `negative_ttl`.
+    Concurrent lookups of the same name share one query. Use it on the
+    event loop only.
+
+    `resolve` races the AAAA and A lookups in the manner of Happy Eyeballs
+    (RFC 8305): IPv6 goes first if it answers first, or within
+    `resolution_delay` seconds of IPv4. The other family is kept as a
+    fallback if it answers within that delay too; a slower answer is not
+    waited for, but still lands in the cache.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        negative_ttl: float = 60.0,
+        min_ttl: float = 5.0,
+        max_ttl: float = 3600.0,
+        resolution_delay: float = 0.05,
+        maxsize: int = 1024,
+        clock=time.monotonic,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.resolution_delay = resolution_delay
+        self.maxsize = maxsize
+        self._clock = clock
+        self._cache = OrderedDict()  # (host, family) -> (expires, addresses)
+        self._inflight = {}  # (host, family) -> asyncio.Task
+        self._aiodns = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _store(self, key, addresses, ttl):
+        self._cache[key] = (self._clock() + ttl, addresses)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def _query(self, host: str, family: int):
+        """
+        Returns:
+            tuple: (addresses, ttl), or (None, None) if the lookup failed
+                   without telling us whether the name exists.
+        """
+        if aiodns is not None:
+            if self._aiodns is None:
+                self._aiodns = aiodns.DNSResolver()
+            try:
+                result = await self._aiodns.getaddrinfo(host, family)
+            except DNSError as e:
+                if e.args and e.args[0] in NEGATIVE_ARES:
+                    return [], self.negative_ttl
+                return None, None
+            addresses, ttl = [], self.max_ttl
+            for node in result.nodes:
+                address = node.addr[0]
+                if isinstance(address, bytes):
+                    address = address.decode()
+                if node.family == family and address not in addresses:
+                    addresses.append(address)
+                    ttl = min(ttl, node.ttl)
+            if not addresses:
+                return [], self.negative_ttl
+            return addresses, min(max(ttl, self.min_ttl), self.max_ttl)
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(
+                host, None, family=family, type=socket.SOCK_RAW
+            )
+        except socket.gaierror as e:
+            if e.errno in NEGATIVE_GAI:
+                return [], self.negative_ttl
+            return None, None
+        except UnicodeError:
+            return [], self.negative_ttl
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        return addresses, self.ttl
+
+    async def lookup(self, host: str, family: int) -> list:
+        """The addresses of one family for a name, [] if it has none."""
+        key = (host.lower(), family)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > self._clock():
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return cached[1]
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, host, family))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None))
+        # Shielded, so a lookup abandoned by the Happy Eyeballs race still
+        # finishes and fills the cache.
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, host, family):
+        addresses, ttl = await self._query(host, family)
+        if addresses is None:
+            return []
+        self._store(key, addresses, ttl)
+        return addresses
+
+    async def resolve(self, host: str) -> list:
+        """
+        Returns:
+            list: (family, address) to probe, the preferred family first and
+                  then the other one to fall back to, or [] if the name has
+                  no addresses.
+        """
+        resolved = literal(host)
+        if resolved is not None:
+            return [resolved]
+        v6 = asyncio.ensure_future(self.lookup(host, socket.AF_INET6))
+        v4 = asyncio.ensure_future(self.lookup(host, socket.AF_INET))
+        try:
+            await asyncio.wait((v6, v4), return_when=asyncio.FIRST_COMPLETED)
+            if any(task.done() and task.result() for task in (v6, v4)):
+                # Give the other family a moment to catch up: IPv6 to go
+                # first, IPv4 to be there should IPv6 prove unreachable.
+                pending = [task for task in (v6, v4) if not task.done()]
+                if pending:
+                    await asyncio.wait(pending, timeout=self.resolution_delay)
+            else:
+                # The first family to answer had nothing; wait for the other.
+                await asyncio.wait((v6, v4))
+            return [
+                (family, task.result()[0])
+                for family, task in ((socket.AF_INET6, v6), (socket.AF_INET, v4))
+                if task.done() and task.result()
+            ]
+        finally:
+            for task in (v6, v4):
+                if not task.done():
+                    task.cancel()
+
+    def close(self):
+        if self._aiodns is not None:
+            self._aiodns.cancel()
+            self._aiodns = None
@@ -0,0 +1,65 @@
+###
+# Copyright (c) 2016 - 2021, Barry Suridge
+# All rights reserved.
+###
+"""
+Background asyncio runtime shared by every MyPing probe.
+"""
+
+import asyncio
+import threading
+
+from supybot import log
+
+
+class AsyncRuntime:
+    """
+    Run one asyncio event loop in a daemon thread for the plugin's lifetime.
+
+    Commands run in worker threads and hand their probes to this loop, so a
+    single ICMP socket can serve every probe in flight.
+    """
+
+    def __init__(self, name: str = "MyPing"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{name} event loop", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the loop and block until it finishes."""
+        return self.submit(coro).result(timeout)
+
+    async def _shutdown(self):
+        tasks = [
+            task
+            for task in asyncio.all_tasks(self.loop)
+            if task is not asyncio.current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self, timeout: float = 5.0):
+        """Cancel outstanding tasks, stop the loop and join its thread."""
+        if self.loop.is_closed() or not self._thread.is_alive():
+            return
+        try:
+            self.submit(self._shutdown()).result(timeout)
+        except Exception as e:
+            log.warning(f"MyPing: unclean event loop shutdown: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
@@ -0,0 +1,234 @@
+###
+# Copyright (c) 2016 - 2021, Barry Suridge
+# All rights reserved.
+###
+"""
+Round trip time statistics kept in fixed-size ring buffers.
+"""
+
+import math
+from array import array
+
+LOST = math.nan
+
+
+class RTTWindow:
+    """
+    The last `size` probes of one host, round trip times in milliseconds.
+
+    Samples live in an array of doubles, lost probes as NaN, so memory is
+    fixed whatever the number of probes. Sums for the mean, deviation and
+    jitter are updated as samples come and go; minimum and maximum are
+    only rescanned when the sample holding them drops out of the window.
+
+    Jitter is the mean difference between consecutive round trip times
+    (as in RFC 3550, without its smoothing), and mdev the standard
+    deviation, as reported by ping.
+    """
+
+    __slots__ = (
+        "size",
+        "_rtts",
+        "_diffs",
+        "_next",
+        "_count",
+        "_received",
+        "_sum",
+        "_sumsq",
+        "_jitter",
+        "_pairs",
+        "_min",
+        "_max",
+        "_evicted",
+    )
+
+    def __init__(self, size: int):
+        self.size = size
+        self._rtts = array("d", [LOST]) * size
+        # |rtt - previous rtt| for each slot, NaN unless both were received
+        # and the previous one is still in the window.
+        self._diffs = array("d", [LOST]) * size
+        self._next = 0
+        self._count = 0
+        self._evicted = 0
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self._received = 0
+        self._sum = self._sumsq = self._jitter = 0.0
+        self._pairs = 0
+        self._min, self._max = math.inf, -math.inf
+
+    def __len__(self):
+        """Probes in the window, received or not."""
+        return self._count
+
+    @property
+    def received(self) -> int:
+        return self._received
+
+    @property
+    def loss(self) -> float:
+        """Lost probes as a percentage of those in the window."""
+        if not self._count:
+            return 0.0
+        return 100.0 * (self._count - self._received) / self._count
+
+    @property
+    def last(self):
+        """The newest round trip time, NaN if that probe was lost."""
+        if not self._count:
+            return LOST
+        return self._rtts[(self._next - 1) % self.size]
+
+    def add(self, rtt):
+        """Record a probe, with `rtt` None (or NaN) if it was lost."""
+        rtt = LOST if rtt is None else float(rtt)
+        slot = self._next
+        # A window of one evicts the previous sample to make room.
+        previous = self.last if self.size > 1 else LOST
+        if self._count == self.size:
+            self._evict(slot)
+        else:
+            self._count += 1
+        diff = abs(rtt - previous)
+        self._rtts[slot] = rtt
+        self._diffs[slot] = diff
+        self._next = (slot + 1) % self.size
+        if not math.isnan(rtt):
+            self._received += 1
+            self._sum += rtt
+            self._sumsq += rtt * rtt
+            self._min = min(self._min, rtt)
+            self._max = max(self._max, rtt)
+        if not math.isnan(diff):
+            self._jitter += diff
+            self._pairs += 1
+
+    def _evict(self, slot):
+        rtt = self._rtts[slot]
+        self._rtts[slot] = LOST
+        if not math.isnan(rtt):
+            self._received -= 1
+            self._sum -= rtt
+            self._sumsq -= rtt * rtt
+            if rtt <= self._min or rtt >= self._max:
+                self._rescan()
+        # The next sample's difference was taken against the evicted one.
+        for i in {slot, (slot + 1) % self.size}:
+            diff = self._diffs[i]
+            self._diffs[i] = LOST
+            if not math.isnan(diff):
+                self._jitter -= diff
+                self._pairs -= 1
+        self._evicted += 1
+        if self._evicted % (self.size * 16) == 0:
+            # Start the running sums afresh now and then so rounding errors
+            # from subtracting evicted samples cannot build up.
+            self._resum()
+
+    def _rescan(self):
+        received = [rtt for rtt in self._rtts if not math.isnan(rtt)]
+        self._min = min(received, default=math.inf)
+        self._max = max(received, default=-math.inf)
+
+    def _resum(self):
+        self._reset_sums()
+        for rtt, diff in zip(self._rtts, self._diffs):
+            if not math.isnan(rtt):
+                self._received += 1
+                self._sum += rtt
+                self._sumsq += rtt * rtt
+                self._min = min(self._min, rtt)
+                self._max = max(self._max, rtt)
+            if not math.isnan(diff):
+                self._jitter += diff
+                self._pairs += 1
+
+    def samples(self) -> list:
+        """The window's round trip times, oldest first, NaN where lost."""
+        if self._count < self.size:
+            return self._rtts[: self._count].tolist()
+        return (self._rtts[self._next :] + self._rtts[: self._next]).tolist()
+
+    def summary(self):
+        """
+        Returns:
+            tuple | None: (min, avg, max, mdev, jitter) in milliseconds, or
+                          None if nothing was received.
+        """
+        if not self._received:
+            return None
+        avg = self._sum / self._received
+        mdev = math.sqrt(max(self._sumsq / self._received - avg * avg, 0.0))
+        jitter = self._jitter / self._pairs if self._pairs else 0.0
+        return self._min, avg, self._max, mdev, jitter
+
+
+def percentile(values: list, p: float) -> float:
+    """The nearest-rank `p`th percentile of sorted, non-empty `values`."""
+    return values[max(math.ceil(p / 100.0 * len(values)) - 1, 0)]
+
+
+class History:
+    """
+    Timestamped probe results of one host, the newest `size` kept.
+
+    Two parallel arrays of doubles hold the probe times and round trip
+    times (NaN when lost), so a host costs 16 bytes per sample however
+    long it is watched. Queries scan back from the newest sample.
+    """
+
+    __slots__ = ("size", "_times", "_rtts", "_next", "_count")
+
+    def __init__(self, size: int):
+        self.size = size
+        self._times = array("d", [0.0]) * size
+        self._rtts = array("d", [LOST]) * size
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, when: float, rtt):
+        """Record a probe sent at `when`, with `rtt` None if it was lost."""
+        self._times[self._next] = when
+        self._rtts[self._next] = LOST if rtt is None else float(rtt)
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def since(self, start: float) -> list:
+        """Round trip times of the probes sent at or after `start`, oldest
+        first, NaN where lost."""
+        rtts = []
+        for i in range(1, self._count + 1):
+            slot = (self._next - i) % self.size
+            if self._times[slot] < start:
+                break
+            rtts.append(self._rtts[slot])
+        rtts.reverse()
+        return rtts
+
+    def uptime(self, start: float):
+        """
+        Returns:
+            tuple | None: (percentage of probes answered, probes), or None
+                          without probes since `start`.
+        """
+        rtts = self.since(start)
+        if not rtts:
+            return None
+        received = sum(not math.isnan(rtt) for rtt in rtts)
+        return 100.0 * received / len(rtts), len(rtts)
+
+    def percentiles(self, start: float, ps=(50, 90, 99)):
+        """
+        Returns:
+            tuple | None: ([round trip time at each of `ps`], min, max,
+                          replies), or None without replies since `start`.
+        """
+        rtts = sorted(rtt for rtt in self.since(start) if not math.isnan(rtt))
+        if not rtts:
+            return None
+        return [percentile(rtts, p) for p in ps], rtts[0], rtts[-1], len(rtts)
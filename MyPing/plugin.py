@@ -27,13 +27,20 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 ###
-import shlex
+import asyncio
+import math
+import re
+import socket
 import subprocess
+import time
 
 ###
 from supybot.commands import *
+from supybot.utils.gen import timeElapsed
 import supybot.ircutils as utils
+import supybot.ircmsgs as ircmsgs
 import supybot.callbacks as callbacks
+import supybot.world as world
 
 try:
     from supybot.i18n import PluginInternationalization
@@ -44,6 +51,18 @@ except ImportError:
     # without the i18n module
     _ = lambda x: x
 from .local.colour import red, teal
+from .local.icmp import ICMPUnavailable, Prober
+from .local.monitor import DOWN, UP, Monitor
+from .local.resolver import Resolver, literal
+from .local.runtime import AsyncRuntime
+from .local.stats import RTTWindow
+
+# Seconds to wait for an echo reply, as with `ping -W 1`.
+TIMEOUT = 1.0
+# Seconds a name lookup may take, on top of the probes.
+RESOLVE_TIMEOUT = 5.0
+# Seconds between probes when sending several, as with ping's default.
+INTERVAL = 1.0
 
 ###############
 #  FUNCTIONS  #
@@ -67,54 +86,479 @@ def is_nick(nick):
     return True
 
 
-def _elapsed_loss(loss):
+def _format_elapsed(elapsed, loss):
+    """Format a round trip time in milliseconds and a packet loss."""
+    time = divmod(int(elapsed), 1000.0)
+
+    return f"Time elapsed: {teal(time)} seconds/milliseconds Packet Loss: {teal(loss)}"
+
+
+def _elapsed(output):
     """
-    :rtype: dict or None
+    Parse the average round trip time from the system ping's summary.
+
+    :rtype: float
     """
-    lines = loss.split("\n")
-    loss = lines[-2].split(",")[2].split()[0]
+    lines = output.split("\n")
     timing = lines[-1].split()[3].split("/")
-    elapsed = int(float(timing[1]))
-    time = divmod(elapsed, 1000.0)
 
-    return f"Time elapsed: {teal(time)} seconds/milliseconds Packet Loss: {teal(loss)}"
+    return float(timing[1])
+
+
+_WINDOW = re.compile(r"(\d+(?:\.\d+)?)([smhdw])", re.I)
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def _parse_window(text):
+    """Seconds in a window such as '90s', '15m', '1h', '2d' or '1w'."""
+    match = _WINDOW.fullmatch(text.strip())
+    if match is None:
+        return None
+    return float(match.group(1)) * _UNITS[match.group(2).lower()]
+
+
+def _format_resolve(resolve):
+    """
+    Describe how a host was resolved: `resolve` is None for an IP address,
+    else (milliseconds, resolved).
+    """
+    if resolve is None:
+        return ""
+    elapsed, resolved = resolve
+    if not resolved:
+        return "unknown host"
+    return f"resolved in {teal(f'{elapsed:.1f} ms')}"
+
+
+def _format_stats(host, window):
+    """Summarise several probes of one host, like ping's statistics."""
+    sent, received = len(window), window.received
+    text = (
+        f"{red(host)} ~ {sent} sent, {received} received, "
+        f"{teal(f'{window.loss:.0f}%')} loss"
+    )
+    summary = window.summary()
+    if summary is not None:
+        low, avg, high, mdev, jitter = summary
+        text += (
+            f" ~ min/avg/max/mdev {teal(f'{low:.1f}/{avg:.1f}/{high:.1f}/{mdev:.1f}')}"
+            f" ms, jitter {teal(f'{jitter:.1f}')} ms"
+        )
+    return text
 
 
 class MyPing(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(MyPing, self)
         self.__parent.__init__(irc)
+        self._runtime = AsyncRuntime()
+        self._prober = None
+        self._resolver = Resolver()
+        self._monitor = Monitor(
+            size=self.registryValue("historySize"),
+            down_after=self.registryValue("downAfter"),
+        )
+        self._runtime.submit(self._monitor_hosts())
+        # Cleared for a family once no ICMP socket can be opened for it; then
+        # only the system ping is left for that family.
+        self._native = {socket.AF_INET: True, socket.AF_INET6: True}
 
     threaded = True
 
-    @wrap(["something"])
-    def ping(self, irc, msg, args, host):
-        """<hostmask> | Nick | IPv4 or IPv6>
-        An alternative to Supybot's PING function.
+    def die(self):
+        try:
+            self._runtime.run(self._close(), 5.0)
+        except Exception as e:
+            self.log.warning(f"MyPing: could not close ICMP sockets: {e}")
+        self._runtime.close()
+        self.__parent.die()
+
+    async def _close(self):
+        self._resolver.close()
+        if self._prober is not None:
+            self._prober.close()
+
+    async def _resolve(self, host):
         """
-        channel = msg.args[0]
+        Returns:
+            tuple: ([(family, address), ...] as for `Resolver.resolve`, empty
+                   if unknown, milliseconds taken)
+        """
+        self._resolver.ttl = self.registryValue("dnsTTL")
+        self._resolver.negative_ttl = self.registryValue("dnsNegativeTTL")
+        start = time.perf_counter()
+        try:
+            resolved = await asyncio.wait_for(
+                self._resolver.resolve(host), RESOLVE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            resolved = []
+        return resolved, (time.perf_counter() - start) * 1000.0
 
-        # Check if we should be 'disabled' in a channel.
-        # config channel #channel plugins.myping.enable True or False (or On or Off)
-        if not self.registryValue("enable", channel):
-            return
+    async def _probe(self, family, address):
+        """
+        Send one echo request to an IP address.
+
+        Returns:
+            float | None: Round trip time in milliseconds, or None when the
+                          host does not answer.
+        """
+        if self._prober is None:
+            self._prober = Prober()
+        try:
+            rtt = await self._prober.ping(address, family, TIMEOUT)
+        except ICMPUnavailable:
+            raise
+        except OSError:
+            # e.g. network unreachable, which is what ping reports too.
+            return None
+        return None if rtt is None else rtt * 1000.0
+
+    def _ping_subprocess(self, address):
+        """The last resort: fork the system ping. Blocks."""
+        cmd = ["ping", "-c", "1", "-W", "1", address]
+        try:
+            reply = subprocess.check_output(cmd).decode().strip()
+        except (subprocess.CalledProcessError, OSError):
+            return None
+        return _elapsed(reply)
+
+    async def _ping_one(self, family, address):
+        """
+        Returns:
+            float | None: Round trip time in milliseconds, or None if
+                          unreachable.
+        """
+        if self._native.get(family, True):
+            try:
+                return await self._probe(family, address)
+            except ICMPUnavailable as e:
+                if self._native.get(family, True):
+                    self.log.warning(
+                        f"MyPing: no ICMP socket for {address} ({e}), "
+                        "falling back to the system ping for its family"
+                    )
+                    self._native[family] = False
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._ping_subprocess, address)
+
+    async def _reach(self, candidates):
+        """
+        Probe a host's addresses in turn until one answers.
+
+        Returns:
+            tuple: (round trip time or None, the (family, address) to keep
+                   probing)
+        """
+        for family, address in candidates:
+            rtt = await self._ping_one(family, address)
+            if rtt is not None:
+                return rtt, (family, address)
+        return None, candidates[0]
+
+    async def _series(self, host, count, interval, first=None):
+        """
+        Resolve a host once, then send it `count` probes, `interval` seconds
+        apart, without waiting for earlier replies, and call
+        `first(host, rtt)` on the first echo. Should the first probe go
+        unanswered, it is retried at the host's other address family, and
+        the rest follow whichever answered.
+
+        Returns:
+            tuple: (RTTWindow of the round trip times in the order they
+                   were sent, resolve as for `_format_resolve`)
+        """
+        window = RTTWindow(count)
+        resolved, resolve = literal(host), None
+        if resolved is not None:
+            candidates = [resolved]
+        else:
+            candidates, elapsed = await self._resolve(host)
+            resolve = (elapsed, bool(candidates))
+        if not candidates:
+            for _ in range(count):
+                window.add(None)
+            return window, resolve
+        reach = asyncio.ensure_future(self._reach(candidates))
+        probes = []
+
+        async def follow():
+            # With a family to fall back to, wait to learn which one works.
+            target = (await reach)[1] if len(candidates) > 1 else candidates[0]
+            return await self._ping_one(*target)
+
+        def answered(probe):
+            if not probe.cancelled() and probe.exception() is None:
+                result = probe.result()
+                first(host, result[0] if probe is reach else result)
+
+        if first is not None:
+            reach.add_done_callback(answered)
+        for _ in range(count - 1):
+            await asyncio.sleep(interval)
+            probe = asyncio.ensure_future(follow())
+            if first is not None:
+                probe.add_done_callback(answered)
+            probes.append(probe)
+        window.add((await reach)[0])
+        for probe in probes:
+            window.add(await probe)
+        return window, resolve
+
+    async def _ping_many(self, hosts, fanout, count=1, interval=INTERVAL, first=None):
+        """Ping every host, at most `fanout` at a time, keeping their order."""
+        semaphore = asyncio.Semaphore(fanout)
+
+        async def bounded(host):
+            async with semaphore:
+                return await self._series(host, count, interval, first)
+
+        return await asyncio.gather(*(bounded(host) for host in hosts))
+
+    def _progress(self, irc):
+        """A callback replying once, to the first echo from any host."""
+        replied = False
+
+        def first(host, rtt):
+            nonlocal replied
+            if rtt is None or replied:
+                return
+            replied = True
+            irc.reply(
+                f"{red(host)} answered in {teal(f'{rtt:.1f} ms')}, waiting for the rest...",
+                prefixNick=False,
+            )
+
+        return first
+
+    async def _monitor_hosts(self):
+        """Probe the watched hosts; runs for the plugin's life."""
+        while True:
+            await asyncio.sleep(self.registryValue("monitorInterval"))
+            try:
+                await self._monitor_once()
+            except Exception as e:
+                self.log.warning(f"MyPing: monitoring watched hosts failed: {e}")
+
+    def _watchers(self):
+        """Group every channel on every network by the hosts it watches."""
+        watchers = {}  # host -> [(irc, channel), ...]
+        for irc in world.ircs:
+            for channel in irc.state.channels:
+                if not self.registryValue("enable", channel, irc.network):
+                    continue
+                for host in self.registryValue("watchlist", channel, irc.network):
+                    watchers.setdefault(host, []).append((irc, channel))
+        return watchers
+
+    async def _monitor_once(self):
+        """
+        Probe every watched host once, a few at a time, and tell their
+        channels about hosts going down or coming back up. Must run on the
+        event loop.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        watchers = self._watchers()
+        self._monitor.prune(watchers)
+        hosts = list(watchers)
+        results = await self._ping_many(hosts, self.registryValue("fanout"))
+        when = time.monotonic()
+        sent = 0
+        for host, (window, _) in zip(hosts, results):
+            rtt = None if math.isnan(window.last) else window.last
+            change = self._monitor.record(host, when, rtt)
+            if change is None:
+                continue
+            state, elapsed = change
+            if state == UP:
+                line = f"{red(host)} is Reachable again ~ {teal(f'{rtt:.1f} ms')}"
+            else:
+                line = f"{red(host)} is Not Reachable"
+            if elapsed is not None:
+                was = "down" if state == UP else "up"
+                line += f" (was {was} for {timeElapsed(elapsed, short=True)})"
+            for irc, channel in watchers[host]:
+                if self.registryValue("monitorAnnounce", channel, irc.network):
+                    irc.queueMsg(ircmsgs.privmsg(channel, line))
+                    sent += 1
+        return sent
+
+    def _watched(self, irc, channel, hosts):
+        """The hosts asked about, or the channel's whole watchlist."""
+        if hosts:
+            return hosts
+        hosts = self.registryValue("watchlist", channel, irc.network)
+        if not hosts:
+            irc.error(f"No hosts are watched in {channel}.", Raise=True)
+        return hosts
+
+    def _window(self, irc, optlist):
+        """
+        Returns:
+            tuple: (monotonic time the window starts, its description)
+        """
+        window = dict(optlist).get("window")
+        if window is None:
+            return -math.inf, "all recorded probes"
+        seconds = _parse_window(window)
+        if seconds is None:
+            irc.error("Windows look like 90s, 15m, 1h, 2d or 1w.", Raise=True)
+        return time.monotonic() - seconds, f"the last {window}"
+
+    def _target(self, irc, host):
+        """The host to ping for a target, looking nicks up on the network."""
         if is_nick(host):  # Valid nick?
-            nick = host
             try:
-                userHostmask = irc.state.nickToHostmask(nick)
+                userHostmask = irc.state.nickToHostmask(host)
                 # Returns the nick and host of a user hostmask.
-                (nick, _, host) = utils.splitHostmask(userHostmask)
+                _, _, host = utils.splitHostmask(userHostmask)
             except KeyError:
                 pass
-        cmd = shlex.split(f"ping -c 1 -W 1 {host}")
-        try:
-            reply = subprocess.check_output(cmd).decode().strip()
-            elapsed_loss = _elapsed_loss(reply)
-        except subprocess.CalledProcessError:
-            # Will print the command failed
-            irc.reply(f"{red(cmd[-1])} is Not Reachable", prefixNick=False)
-        else:
-            irc.reply(f"{red(cmd[-1])} is Reachable ~ {elapsed_loss}", prefixNick=False)
+        return host
+
+    @wrap(
+        [
+            getopts({"count": "positiveInt", "interval": "float", "progress": ""}),
+            many("something"),
+        ]
+    )
+    def ping(self, irc, msg, args, optlist, hosts):
+        """[--count <n>] [--interval <seconds>] [--progress] <hostname | Nick | IPv4 or IPv6> [<hostname | Nick | IPv4 or IPv6> ...]
+        An alternative to Supybot's PING function. Several hosts are pinged
+        at once and answered in one reply. With --count, sends <n> probes
+        --interval seconds apart and reports min/avg/max/mdev and jitter;
+        --progress replies as soon as the first echo comes back, unless
+        that is the only probe.
+        """
+        channel = msg.args[0]
+
+        # Check if we should be 'disabled' in a channel.
+        # config channel #channel plugins.myping.enable True or False (or On or Off)
+        if not self.registryValue("enable", channel):
+            return
+        # Drop duplicates, e.g. a nick and the host it is connected from.
+        hosts = list(dict.fromkeys(self._target(irc, host) for host in hosts))
+        maxtargets = self.registryValue("maxTargets", channel, irc.network)
+        if len(hosts) > maxtargets:
+            irc.error(f"I can only ping {maxtargets} hosts at once.", Raise=True)
+        opts = dict(optlist)
+        count = opts.get("count", 1)
+        maxcount = self.registryValue("maxCount", channel, irc.network)
+        if count > maxcount:
+            irc.error(f"I can only send {maxcount} probes per host.", Raise=True)
+        interval = opts.get("interval", INTERVAL)
+        maxinterval = self.registryValue("maxInterval")
+        if not math.isfinite(interval):
+            irc.error("--interval must be a finite number of seconds.", Raise=True)
+        if interval > maxinterval:
+            irc.error(
+                f"I can only wait {maxinterval:g} seconds between probes.", Raise=True
+            )
+        interval = max(interval, self.registryValue("minInterval"))
+        # A single probe's progress line would only repeat the reply.
+        first = (
+            self._progress(irc)
+            if "progress" in opts and count * len(hosts) > 1
+            else None
+        )
+        fanout = self.registryValue("fanout", channel, irc.network)
+        rounds = math.ceil(len(hosts) / fanout)
+        # Falling back to a host's other address family can hold its probes
+        # back by two timeouts.
+        results = self._runtime.run(
+            self._ping_many(hosts, fanout, count, interval, first),
+            rounds * (RESOLVE_TIMEOUT + (count - 1) * interval + 3 * TIMEOUT) + 5.0,
+        )
+        windows = [window for window, _ in results]
+        resolves = [_format_resolve(resolve) for _, resolve in results]
+        if count > 1:
+            reachable = sum(window.received > 0 for window in windows)
+            results = " | ".join(
+                _format_stats(host, window) + (f" ~ {resolve}" if resolve else "")
+                for host, window, resolve in zip(hosts, windows, resolves)
+            )
+            if len(hosts) > 1:
+                results = f"{reachable} of {len(hosts)} Reachable ~ {results}"
+            irc.reply(results, prefixNick=False)
+            return
+        rtts = [None if math.isnan(window.last) else window.last for window in windows]
+        if len(hosts) == 1:
+            resolve = f" ~ {resolves[0]}" if resolves[0] else ""
+            if rtts[0] is None:
+                irc.reply(
+                    f"{red(hosts[0])} is Not Reachable{resolve}", prefixNick=False
+                )
+            else:
+                elapsed_loss = _format_elapsed(rtts[0], "0%")
+                irc.reply(
+                    f"{red(hosts[0])} is Reachable ~ {elapsed_loss}{resolve}",
+                    prefixNick=False,
+                )
+            return
+        reachable = sum(rtt is not None for rtt in rtts)
+        results = ", ".join(
+            f"{red(host)} "
+            + ("Not Reachable" if rtt is None else teal(f"{rtt:.1f} ms"))
+            + (f" ({resolve})" if resolve else "")
+            for host, rtt, resolve in zip(hosts, rtts, resolves)
+        )
+        irc.reply(
+            f"{reachable} of {len(hosts)} Reachable ~ {results}", prefixNick=False
+        )
+
+    @wrap(["channel", getopts({"window": "something"}), any("something")])
+    def availability(self, irc, msg, args, channel, optlist, hosts):
+        """[<channel>] [--window <90s|15m|1h|2d|1w>] [<host> ...]
+        Reports how many probes of watched hosts were answered, over the
+        window or all recorded probes. Defaults to the channel's watchlist.
+        """
+        if not self.registryValue("enable", channel, irc.network):
+            return
+        hosts = self._watched(irc, channel, hosts)
+        start, described = self._window(irc, optlist)
+        results = []
+        for host in hosts:
+            history = self._monitor.history(host)
+            uptime = None if history is None else history.uptime(start)
+            if uptime is None:
+                results.append(f"{red(host)} no probes yet")
+                continue
+            percent, probes = uptime
+            state, since = self._monitor.state(host)
+            text = f"{red(host)} {teal(f'{percent:.1f}%')} up ({probes} probes)"
+            if state is not None:
+                elapsed = timeElapsed(time.monotonic() - since, short=True)
+                text += f", {state} for {elapsed}"
+            results.append(text)
+        irc.reply(f"Over {described}: " + " | ".join(results), prefixNick=False)
+
+    @wrap(["channel", getopts({"window": "something"}), "something"])
+    def latency(self, irc, msg, args, channel, optlist, host):
+        """[<channel>] [--window <90s|15m|1h|2d|1w>] <host>
+        Reports round trip time percentiles of a watched host, over the
+        window or all recorded probes.
+        """
+        if not self.registryValue("enable", channel, irc.network):
+            return
+        start, described = self._window(irc, optlist)
+        history = self._monitor.history(host)
+        if history is None:
+            irc.error(f"{host} is not being watched.", Raise=True)
+        result = history.percentiles(start)
+        if result is None:
+            irc.reply(
+                f"{red(host)} has not answered over {described}.", prefixNick=False
+            )
+            return
+        (p50, p90, p99), low, high, replies = result
+        irc.reply(
+            f"{red(host)} over {described} ~ p50/p90/p99 "
+            f"{teal(f'{p50:.1f}/{p90:.1f}/{p99:.1f}')} ms, min/max "
+            f"{teal(f'{low:.1f}/{high:.1f}')} ms ({replies} replies)",
+            prefixNick=False,
+        )
 
 
 Class = MyPing
@@ -5,16 +5,423 @@
 #
 ###
 
+import asyncio
+import socket
+import time
+
 from supybot.test import *
 import supybot.conf as conf
 
+from .local import icmp
+from .local.monitor import DOWN, UP, Monitor
+from .local.resolver import Resolver
+from .local.stats import History, RTTWindow
+
+
+def _icmp_available():
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+    except OSError:
+        try:
+            socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP).close()
+        except OSError:
+            return False
+    return True
+
+
+class ICMPTestCase(SupyTestCase):
+    def testChecksum(self):
+        packet = icmp.echo_request(socket.AF_INET, 0x1234, 1)
+        self.assertEqual(icmp.checksum(packet), 0)
+        self.assertEqual(icmp.checksum(b"\x00\x01\xf2\x03"), 0x0DFB)
+
+    def testParse(self):
+        channel = object.__new__(icmp._Channel)
+        channel.family, channel.raw, channel.ident = socket.AF_INET, False, 0x1234
+        reply = icmp.HEADER.pack(0, 0, 0, 0x1234, 7) + icmp.PAYLOAD
+        ip = bytes([0x45]) + bytes(19)
+        self.assertEqual(channel.parse(reply), (0x1234, 7))
+        # Datagram sockets on macOS deliver the IP header as well.
+        self.assertEqual(channel.parse(ip + reply), (0x1234, 7))
+        channel.raw = True
+        self.assertEqual(channel.parse(ip + reply), (0x1234, 7))
+        request = icmp.echo_request(socket.AF_INET, 0x1234, 7)
+        self.assertIsNone(channel.parse(ip + request))
+
+    def testConcurrentProbes(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+
+        async def probe():
+            prober = icmp.Prober()
+            try:
+                return await asyncio.gather(
+                    *(prober.ping("127.0.0.1", socket.AF_INET) for _ in range(10))
+                ), len(prober._channels)
+            finally:
+                prober.close()
+
+        rtts, sockets = asyncio.run(probe())
+        self.assertEqual(sockets, 1)
+        for rtt in rtts:
+            self.assertIsNotNone(rtt)
+            self.assertLess(rtt, 1.0)
+
+
+class RTTWindowTestCase(SupyTestCase):
+    def testSummary(self):
+        window = RTTWindow(4)
+        self.assertIsNone(window.summary())
+        for rtt in (10.0, 12.0, None, 14.0):
+            window.add(rtt)
+        self.assertEqual(len(window), 4)
+        self.assertEqual(window.loss, 25.0)
+        low, avg, high, mdev, jitter = window.summary()
+        self.assertEqual((low, avg, high), (10.0, 12.0, 14.0))
+        self.assertAlmostEqual(mdev, (8 / 3) ** 0.5)
+        # Only 10 -> 12 are consecutive replies.
+        self.assertEqual(jitter, 2.0)
+
+    def testEviction(self):
+        window = RTTWindow(3)
+        for rtt in (50.0, 1.0, 2.0, 4.0):
+            window.add(rtt)
+        self.assertEqual(window.samples(), [1.0, 2.0, 4.0])
+        low, avg, high, _, jitter = window.summary()
+        self.assertEqual((low, high), (1.0, 4.0))
+        self.assertAlmostEqual(avg, 7 / 3)
+        # 50 -> 1 left the window with 50.
+        self.assertAlmostEqual(jitter, (1.0 + 2.0) / 2)
+        for _ in range(3):
+            window.add(None)
+        self.assertEqual(window.loss, 100.0)
+        self.assertIsNone(window.summary())
+
+    def testManyEvictions(self):
+        window = RTTWindow(5)
+        for i in range(1000):
+            window.add(float(i % 7))
+        low, avg, high, _, jitter = window.summary()
+        expected = [float(i % 7) for i in range(995, 1000)]
+        self.assertEqual(window.samples(), expected)
+        self.assertEqual((low, high), (min(expected), max(expected)))
+        self.assertAlmostEqual(avg, sum(expected) / 5)
+        diffs = [abs(b - a) for a, b in zip(expected, expected[1:])]
+        self.assertAlmostEqual(jitter, sum(diffs) / 4)
+
+
+class MonitorTestCase(SupyTestCase):
+    def testHistory(self):
+        history = History(4)
+        for when, rtt in enumerate((9.0, 1.0, None, 3.0, 2.0)):
+            history.add(float(when), rtt)
+        self.assertEqual(len(history), 4)
+        self.assertEqual(history.uptime(0.0), (75.0, 4))
+        self.assertEqual(history.uptime(3.0), (100.0, 2))
+        self.assertIsNone(history.uptime(5.0))
+        self.assertEqual(history.percentiles(0.0, (50, 100)), ([2.0, 3.0], 1.0, 3.0, 3))
+
+    def testStateChanges(self):
+        monitor = Monitor(size=8, down_after=2)
+        self.assertIsNone(monitor.record("host", 0.0, 5.0))
+        self.assertEqual(monitor.state("host"), (UP, 0.0))
+        # One lost probe is not enough.
+        self.assertIsNone(monitor.record("host", 60.0, None))
+        self.assertEqual(monitor.record("host", 120.0, None), (DOWN, 120.0))
+        self.assertIsNone(monitor.record("host", 180.0, None))
+        self.assertEqual(monitor.record("host", 240.0, 5.0), (UP, 120.0))
+        monitor.prune(["other"])
+        self.assertNotIn("host", monitor)
+
+    def testDownFromTheStart(self):
+        monitor = Monitor(size=8, down_after=1)
+        self.assertEqual(monitor.record("host", 0.0, None), (DOWN, None))
+
+
+class FakeResolver(Resolver):
+    """Answers from a table, taking `delays[family]` seconds."""
+
+    def __init__(self, answers, delays, **kwargs):
+        super().__init__(**kwargs)
+        self.answers = answers
+        self.delays = delays
+        self.queries = 0
+
+    async def _query(self, host, family):
+        self.queries += 1
+        await asyncio.sleep(self.delays.get(family, 0))
+        addresses = self.answers.get((host, family), [])
+        return addresses, 30.0 if addresses else self.negative_ttl
+
+
+class ResolverTestCase(SupyTestCase):
+    answers = {
+        ("dual.test", socket.AF_INET): ["192.0.2.1"],
+        ("dual.test", socket.AF_INET6): ["2001:db8::1"],
+        ("v4.test", socket.AF_INET): ["192.0.2.2"],
+    }
+
+    def testLiteral(self):
+        resolver = FakeResolver({}, {})
+        self.assertEqual(
+            asyncio.run(resolver.resolve("2001:DB8::1")),
+            [(socket.AF_INET6, "2001:db8::1")],
+        )
+        self.assertEqual(resolver.queries, 0)
+
+    def testHappyEyeballs(self):
+        def resolve(host, delays):
+            resolver = FakeResolver(self.answers, delays, resolution_delay=0.05)
+            return asyncio.run(resolver.resolve(host))
+
+        dual = [(socket.AF_INET6, "2001:db8::1"), (socket.AF_INET, "192.0.2.1")]
+        # IPv6 answering within the resolution delay of IPv4 still wins.
+        self.assertEqual(resolve("dual.test", {socket.AF_INET6: 0.02}), dual)
+        # IPv4 is kept to fall back to when it answers soon after IPv6.
+        self.assertEqual(resolve("dual.test", {socket.AF_INET: 0.02}), dual)
+        # A slow answer of either family is not waited for.
+        self.assertEqual(resolve("dual.test", {socket.AF_INET6: 0.5}), dual[1:])
+        self.assertEqual(resolve("dual.test", {socket.AF_INET: 0.5}), dual[:1])
+        # An empty first answer waits for the other family.
+        self.assertEqual(
+            resolve("v4.test", {socket.AF_INET: 0.1}), [(socket.AF_INET, "192.0.2.2")]
+        )
+        self.assertEqual(resolve("none.test", {}), [])
+
+    def testCache(self):
+        now = [0.0]
+        resolver = FakeResolver(
+            self.answers, {}, negative_ttl=10.0, clock=lambda: now[0]
+        )
+
+        async def resolve(host):
+            return await resolver.resolve(host)
+
+        asyncio.run(resolve("v4.test"))
+        self.assertEqual(resolver.queries, 2)
+        asyncio.run(resolve("v4.test"))
+        self.assertEqual(resolver.queries, 2)
+        # The empty AAAA answer expires first.
+        now[0] = 15.0
+        asyncio.run(resolve("v4.test"))
+        self.assertEqual(resolver.queries, 3)
+        now[0] = 31.0
+        asyncio.run(resolve("v4.test"))
+        self.assertEqual(resolver.queries, 5)
+        asyncio.run(resolve("none.test"))
+        asyncio.run(resolve("none.test"))
+        self.assertEqual(resolver.queries, 7)
+
+    def testConcurrentLookupsShareOneQuery(self):
+        resolver = FakeResolver(self.answers, {socket.AF_INET: 0.02})
+
+        async def resolve():
+            return await asyncio.gather(
+                *(resolver.lookup("v4.test", socket.AF_INET) for _ in range(5))
+            )
+
+        self.assertEqual(asyncio.run(resolve()), [["192.0.2.2"]] * 5)
+        self.assertEqual(resolver.queries, 1)
+
 
 class MyPingTestCase(PluginTestCase):
     plugins = ("MyPing",)
 
+    def setUp(self):
+        super().setUp()
+        conf.supybot.plugins.MyPing.enable.setValue(True)
+
     def testSimple(self):
         self.assertNotError("myping ping google.com")
         self.assertNotError("myping ping 2a03:2880:f119:8083:face:b00c:0:25de")
 
+    def testLoopback(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+        self.assertRegexp("myping ping 127.0.0.1", "is Reachable")
+
+    def testUnresolvable(self):
+        self.assertRegexp(
+            "myping ping no-such-host.invalid", "Not Reachable ~ unknown host"
+        )
+
+    def testDNSSettings(self):
+        resolver = self.irc.getCallback("MyPing")._resolver
+        with conf.supybot.plugins.MyPing.dnsTTL.context(
+            30
+        ), conf.supybot.plugins.MyPing.dnsNegativeTTL.context(7):
+            self.assertNotError("myping ping no-such-host.invalid")
+        self.assertEqual((resolver.ttl, resolver.negative_ttl), (30, 7))
+
+    def testResolveTime(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+        self.assertRegexp("myping ping localhost", r"resolved in \S+ ms")
+        self.assertNotRegexp("myping ping 127.0.0.1", "resolved")
+
+    def testMultipleHosts(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+        with conf.supybot.plugins.MyPing.fanout.context(2):
+            m = self.assertNotError(
+                "myping ping 127.0.0.1 no-such-host.invalid ::1 127.0.0.1"
+            )
+        self.assertIn("2 of 3 Reachable", m.args[1])
+        self.assertIn(
+            "no-such-host.invalid Not Reachable", ircutils.stripFormatting(m.args[1])
+        )
+
+    def testCount(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+        with conf.supybot.plugins.MyPing.minInterval.context(0.05):
+            m = self.assertNotError(
+                "myping ping --count 3 --interval 0.05 127.0.0.1", timeout=5
+            )
+        reply = ircutils.stripFormatting(m.args[1])
+        self.assertIn("3 sent, 3 received, 0% loss", reply)
+        self.assertIn("min/avg/max/mdev", reply)
+        self.assertIn("jitter", reply)
+
+    def testProgress(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+        with conf.supybot.plugins.MyPing.minInterval.context(0.05):
+            self.assertRegexp(
+                "myping ping --progress --count 2 --interval 0.05 127.0.0.1",
+                "answered in",
+            )
+            m = self.irc.takeMsg()
+            for _ in range(50):
+                if m is not None:
+                    break
+                time.sleep(0.1)
+                m = self.irc.takeMsg()
+        self.assertIn("2 received", m.args[1])
+
+    def testFallbackPerFamily(self):
+        cb = self.irc.getCallback("MyPing")
+        probed, forked = [], []
+
+        async def probe(family, address):
+            probed.append(address)
+            if family == socket.AF_INET6:
+                raise icmp.ICMPUnavailable(1, "Operation not permitted")
+            return 1.0
+
+        def ping_subprocess(address):
+            forked.append(address)
+            return 2.0
+
+        cb._probe, cb._ping_subprocess = probe, ping_subprocess
+        try:
+            cb._runtime.run(cb._ping_one(socket.AF_INET6, "::1"), 5)
+            cb._runtime.run(cb._ping_one(socket.AF_INET6, "::1"), 5)
+            cb._runtime.run(cb._ping_one(socket.AF_INET, "127.0.0.1"), 5)
+        finally:
+            del cb._probe, cb._ping_subprocess
+            cb._native = {socket.AF_INET: True, socket.AF_INET6: True}
+        self.assertEqual(probed, ["::1", "127.0.0.1"])
+        self.assertEqual(forked, ["::1", "::1"])
+
+    def testOtherFamilyFallback(self):
+        cb = self.irc.getCallback("MyPing")
+        resolver, probed = cb._resolver, []
+
+        async def ping_one(family, address):
+            probed.append(address)
+            # IPv6 is resolved but unreachable from here.
+            return None if family == socket.AF_INET6 else 1.0
+
+        cb._resolver = FakeResolver(ResolverTestCase.answers, {})
+        cb._ping_one = ping_one
+        try:
+            with conf.supybot.plugins.MyPing.minInterval.context(0.05):
+                m = self.assertNotError(
+                    "myping ping --count 3 --interval 0.05 dual.test"
+                )
+        finally:
+            cb._resolver = resolver
+            del cb._ping_one
+        self.assertIn("3 received", m.args[1])
+        self.assertEqual(probed, ["2001:db8::1"] + ["192.0.2.1"] * 3)
+
+    def testProgressSingleProbe(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+        self.assertRegexp("myping ping --progress 127.0.0.1", "is Reachable")
+        time.sleep(0.1)
+        self.assertIsNone(self.irc.takeMsg())
+
+    def testCountLimit(self):
+        with conf.supybot.plugins.MyPing.maxCount.context(2):
+            self.assertError("myping ping --count 3 127.0.0.1")
+
+    def testIntervalLimits(self):
+        self.assertRegexp("myping ping --count 2 --interval inf 127.0.0.1", "finite")
+        self.assertRegexp("myping ping --count 2 --interval nan 127.0.0.1", "finite")
+        with conf.supybot.plugins.MyPing.maxInterval.context(5.0):
+            self.assertRegexp(
+                "myping ping --count 2 --interval 6 127.0.0.1", "5 seconds"
+            )
+
+    def testTooManyHosts(self):
+        with conf.supybot.plugins.MyPing.maxTargets.context(2):
+            self.assertError("myping ping a.invalid b.invalid c.invalid")
+
+
+class MyPingMonitorTestCase(ChannelPluginTestCase):
+    plugins = ("MyPing",)
+    config = {"supybot.plugins.MyPing.enable": True}
+
+    def setUp(self):
+        super().setUp()
+        self.cb = self.irc.getCallback("MyPing")
+        self.watchlist = conf.supybot.plugins.MyPing.watchlist.getSpecific(
+            self.irc.network, self.channel
+        )
+        self.watchlist.setValue([])
+
+    def reply(self, query):
+        return ircutils.stripFormatting(self.assertNotError(query).args[1])
+
+    def testNothingWatched(self):
+        self.assertError("availability")
+
+    def testMonitor(self):
+        if not _icmp_available():
+            self.skipTest("ICMP sockets are not permitted here")
+        self.watchlist.setValue(["127.0.0.1", "down.invalid"])
+        self.assertEqual(self.cb._runtime.run(self.cb._monitor_once()), 0)
+        self.assertEqual(self.cb._runtime.run(self.cb._monitor_once()), 1)
+        m = self.irc.takeMsg()
+        self.assertEqual(m.args[0], self.channel)
+        self.assertIn(
+            "down.invalid is Not Reachable", ircutils.stripFormatting(m.args[1])
+        )
+        self.assertRegex(
+            self.reply("availability"), r"127\.0\.0\.1 100\.0% up \(2 probes\), up for"
+        )
+        self.assertRegex(
+            self.reply("availability --window 1h down.invalid"),
+            r"0\.0% up \(2 probes\), down",
+        )
+        self.assertRegex(
+            self.reply("latency 127.0.0.1"), r"p50/p90/p99 .* \(2 replies\)"
+        )
+        self.assertRegex(self.reply("latency down.invalid"), "has not answered")
+        self.assertError("latency --window soon 127.0.0.1")
+        self.assertError("latency example.invalid")
+        self.watchlist.setValue(["127.0.0.1"])
+        self.cb._runtime.run(self.cb._monitor_once())
+        self.assertNotIn("down.invalid", self.cb._monitor)
+
+    def testNoAnnouncements(self):
+        self.watchlist.setValue(["down.invalid"])
+        with conf.supybot.plugins.MyPing.monitorAnnounce.context(False):
+            for _ in range(2):
+                self.assertEqual(self.cb._runtime.run(self.cb._monitor_once()), 0)
+        self.assertRegex(self.reply("availability"), r"invalid 0\.0% up")
+
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -58,10 +58,42 @@ if sys.version_info <= (3, 9):
     raise RuntimeError("This plugin requires Python 3.9 or above.")
 from . import config
 from . import plugin
+from .local import (
+    admission,
+    breaker,
+    cache,
+    geocache,
+    geohash,
+    normalize,
+    popularity,
+    postcodes,
+    ratelimit,
+    records,
+    reverse,
+    runtime,
+    shared,
+    snapshot,
+    stats,
+)
 from importlib import reload
 
 # In case we're being reloaded.
 reload(config)
+reload(admission)
+reload(breaker)
+reload(cache)
+reload(geocache)
+reload(geohash)
+reload(normalize)
+reload(popularity)
+reload(postcodes)
+reload(ratelimit)
+reload(records)
+reload(reverse)
+reload(runtime)
+reload(shared)
+reload(snapshot)
+reload(stats)
 reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
@@ -0,0 +1,294 @@
+###
+# Copyright (c) 2021 - 2024, Barry Suridge
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+"""
+Load benchmarks for the Weatherstack plugin.
+
+A local aiohttp server stands in for api.weatherstack.com/current and
+OpenWeatherMap's geo/1.0/zip and geo/1.0/reverse endpoints, with
+configurable latency and error injection. The plugin is driven through
+PluginTestCase at increasing concurrency; each level reports p50/p95/p99
+latency, throughput and upstream calls, and fails when it regresses past
+bench_baseline.json.
+
+    WEATHERSTACK_BENCH=1 supybot-test ./Weatherstack       # run and compare
+    WEATHERSTACK_BENCH=update supybot-test ./Weatherstack  # record baselines
+
+WEATHERSTACK_BENCH_LATENCY (ms, default 50), WEATHERSTACK_BENCH_ERRORS
+(fraction of failed upstream calls, default 0) and
+WEATHERSTACK_BENCH_TOLERANCE (default 1.5) tune a run. Baselines are only
+compared for runs at the baseline's latency with no injected errors.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+from aiohttp import web
+from supybot import drivers, ircmsgs
+from supybot.test import *
+
+from .local.runtime import AsyncRuntime
+
+BASELINE = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+LEVELS = (1, 4, 16, 64)
+TOWNS = [
+    "ballarat, au",
+    "bendigo, au",
+    "geelong, au",
+    "melbourne, au",
+    "sydney, au",
+    "hobart, au",
+    "london, gb",
+    "paris, fr",
+]
+POSTCODES = {
+    "3350, au": (-37.5622, 143.8503),
+    "3550, au": (-36.7570, 144.2794),
+    "3220, au": (-38.1499, 144.3617),
+    "3000, au": (-37.8136, 144.9631),
+}
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class MockUpstream:
+    """Serve fake Weatherstack and OpenWeatherMap responses on localhost."""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._runtime = AsyncRuntime(name="Weatherstack mock upstream")
+        self.port = self._runtime.run(self._start())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def _start(self) -> int:
+        app = web.Application()
+        app.router.add_get("/current", self.current)
+        app.router.add_get("/geo/1.0/zip", self.zip)
+        app.router.add_get("/geo/1.0/reverse", self.reverse)
+        self._app_runner = web.AppRunner(app, access_log=None)
+        await self._app_runner.setup()
+        site = web.TCPSite(self._app_runner, "127.0.0.1", 0)
+        await site.start()
+        return self._app_runner.addresses[0][1]
+
+    async def _serve(self, endpoint: str) -> bool:
+        """Count and delay a call; return True if it should fail."""
+        self.calls[endpoint] += 1
+        await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+        return random.random() < self.error_rate
+
+    async def current(self, request):
+        if await self._serve("current"):
+            return web.Response(status=500)
+        results = [self.observation(q) for q in request.query["query"].split(";")]
+        return web.json_response(results if len(results) > 1 else results[0])
+
+    async def zip(self, request):
+        if await self._serve("zip"):
+            return web.Response(status=500)
+        code = request.query["zip"]
+        lat, lon = POSTCODES.get(code, (-37.5622, 143.8503))
+        return web.json_response({"zip": code, "name": "Town", "lat": lat, "lon": lon})
+
+    async def reverse(self, request):
+        if await self._serve("reverse"):
+            return web.Response(status=500)
+        return web.json_response([{"name": "Town", "state": "State", "country": "AU"}])
+
+    @staticmethod
+    def observation(query: str) -> dict:
+        return {
+            "request": {"query": query},
+            "location": {
+                "name": query.split(",")[0].title(),
+                "region": "Region",
+                "country": "Country",
+                "lat": "-37.567",
+                "lon": "143.850",
+                "localtime": "2025-01-08 12:05",
+            },
+            "current": {
+                "temperature": 21,
+                "feelslike": 20,
+                "weather_descriptions": ["Partly cloudy"],
+                "wind_speed": 12,
+                "wind_dir": "N",
+                "humidity": 50,
+                "precip": 0,
+                "uv_index": 5,
+            },
+        }
+
+    def close(self):
+        self._runtime.run(self._app_runner.cleanup())
+        self._runtime.close()
+
+
+class WeatherstackBenchmarkCase(PluginTestCase):
+    plugins = ("Weatherstack",)
+    config = {
+        "supybot.plugins.Weatherstack.enabled": True,
+        "supybot.plugins.Weatherstack.weatherstackAPI": "bench",
+        "supybot.plugins.Weatherstack.openweatherAPI": "bench",
+        "supybot.plugins.Weatherstack.userRequestsPerMinute": 0,
+        "supybot.plugins.Weatherstack.channelRequestsPerMinute": 0,
+    }
+    timeout = 60
+
+    def setUp(self):
+        super().setUp()
+        self.latency = float(os.environ.get("WEATHERSTACK_BENCH_LATENCY", 50))
+        self.error_rate = float(os.environ.get("WEATHERSTACK_BENCH_ERRORS", 0))
+        self.upstream = MockUpstream(self.latency / 1000, self.error_rate)
+        self.cb = self.irc.getCallback("Weatherstack")
+        self.module = sys.modules[self.cb.__class__.__module__]
+        self.urls = {
+            "WEATHERSTACK_URL": f"{self.upstream.url}/current",
+            "OPENWEATHER_ZIP_URL": f"{self.upstream.url}/geo/1.0/zip",
+            "OPENWEATHER_REVERSE_URL": f"{self.upstream.url}/geo/1.0/reverse",
+        }
+        self.urls = {
+            name: (getattr(self.module, name), url) for name, url in self.urls.items()
+        }
+        for name, (_, url) in self.urls.items():
+            setattr(self.module, name, url)
+        # pgeocode would download postcode tables; send postcodes upstream.
+        self.cb._nominatim.query = lambda postcode, country: None
+        # Build the offline reverse geocoder now rather than inside a burst.
+        self.cb._reverse.load()
+
+    def tearDown(self):
+        for name, (original, _) in self.urls.items():
+            setattr(self.module, name, original)
+        self.upstream.close()
+        super().tearDown()
+
+    def _burst(self, queries: list[str]):
+        """Send every query at once; return reply latencies, errors, elapsed."""
+        sent = {}
+        for i, query in enumerate(queries):
+            nick = f"bench{i}"
+            prefix = f"{nick}!user@bench{i}.example.org"
+            sent[nick] = time.perf_counter()
+            self.irc.feedMsg(ircmsgs.privmsg(self.irc.nick, query, prefix=prefix))
+        start = min(sent.values())
+        latencies, errors = [], 0
+        deadline = start + self.timeout
+        while sent and time.perf_counter() < deadline:
+            drivers.run()
+            reply = self.irc.takeMsg()
+            if reply is None:
+                time.sleep(0.001)
+                continue
+            started = sent.pop(reply.args[0], None)
+            if started is None:
+                continue
+            latencies.append(time.perf_counter() - started)
+            if reply.args[1].startswith("Error"):
+                errors += 1
+        self.assertFalse(sent, f"{len(sent)} weather commands got no reply.")
+        return latencies, errors, time.perf_counter() - start
+
+    def testConcurrency(self):
+        pool = TOWNS + list(POSTCODES)
+        results = {}
+        for level in LEVELS:
+            self.cb._weather_cache.clear()
+            self.upstream.calls.clear()
+            queries = [f"weather {pool[i % len(pool)]}" for i in range(level)]
+            latencies, errors, elapsed = self._burst(queries)
+            results[str(level)] = result = {
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                "throughput": round(level / elapsed, 1),
+                "upstream_calls": sum(self.upstream.calls.values()),
+                "errors": errors,
+            }
+            calls = ", ".join(
+                f"{k}={v}" for k, v in sorted(self.upstream.calls.items())
+            )
+            print(
+                f"\nconcurrency {level}: p50 {result['p50_ms']} ms, "
+                f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+                f"{result['throughput']} req/s, upstream {calls}, errors {errors}"
+            )
+        if os.environ.get("WEATHERSTACK_BENCH") == "update":
+            with open(BASELINE, "w") as f:
+                json.dump({"latency_ms": self.latency, "levels": results}, f, indent=4)
+                f.write("\n")
+            return
+        self._compare(results)
+
+    def _compare(self, results: dict):
+        if not os.path.exists(BASELINE):
+            return
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        if self.error_rate or baseline["latency_ms"] != self.latency:
+            print("\nNot comparing with the baseline: the mock upstream differs.")
+            return
+        tolerance = float(os.environ.get("WEATHERSTACK_BENCH_TOLERANCE", 1.5))
+        for level, base in baseline["levels"].items():
+            result = results.get(level)
+            if result is None:
+                continue
+            self.assertLessEqual(
+                result["p95_ms"],
+                base["p95_ms"] * tolerance,
+                f"p95 latency regressed at concurrency {level}.",
+            )
+            self.assertGreaterEqual(
+                result["throughput"],
+                base["throughput"] / tolerance,
+                f"Throughput regressed at concurrency {level}.",
+            )
+            self.assertLessEqual(
+                result["upstream_calls"],
+                base["upstream_calls"],
+                f"Upstream calls regressed at concurrency {level}.",
+            )
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
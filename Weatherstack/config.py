@@ -50,6 +50,18 @@ def configure(advanced):
     conf.registerPlugin("Weatherstack", True)
 
 
+class Locations(registry.SeparatedListOf):
+    """A list of locations separated by semicolons."""
+
+    __slots__ = ()
+    Value = registry.String
+
+    def splitter(self, s):
+        return [part.strip() for part in s.split(";") if part.strip()]
+
+    joiner = "; ".join
+
+
 Weatherstack = conf.registerPlugin("Weatherstack")
 # This is where your configuration variables (if any) should go.  For example:
 # conf.registerGlobalValue(DALnet, 'someConfigVariableName',
@@ -62,6 +74,187 @@ conf.registerGlobalValue(
     "weatherstackAPI",
     registry.String("", _("""Sets the API key for Weatherstack."""), private=True),
 )
+conf.registerGlobalValue(
+    Weatherstack,
+    "cacheSize",
+    registry.PositiveInteger(
+        256, _("""Sets the number of locations kept in the weather cache.""")
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "cacheTTL",
+    registry.NonNegativeInteger(
+        600,
+        _("""Sets how long, in seconds, a cached weather observation is
+            considered fresh. 0 disables the weather cache."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "cacheStaleTTL",
+    registry.NonNegativeInteger(
+        1800,
+        _("""Sets how long, in seconds, an expired weather observation may
+            still be served while it is refreshed in the background."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "sharedCache",
+    registry.String(
+        "",
+        _("""Sets a cache shared by every bot on this host, so they look up
+            each location only once between them, as backend:location. The
+            only backend is sqlite:<file>, which also holds the geocoding
+            cache. Empty keeps a private cache. Takes effect on reload."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "cacheSnapshot",
+    registry.Boolean(
+        True,
+        _("""Determines whether the weather cache, learned location aliases
+            and popularity counts are saved when the plugin is unloaded and
+            restored, with their ages, when it loads again."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "prefetchSize",
+    registry.NonNegativeInteger(
+        0,
+        _("""Sets how many of the most asked-for locations are refreshed in
+            the background just before their cache entries expire, so they
+            are always answered from the cache. Each costs one Weatherstack
+            call per cacheTTL. 0 disables prefetching."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "prefetchQuotaReserve",
+    registry.Probability(
+        0.2,
+        _("""Sets the share of the Weatherstack monthly quota that prefetching
+            leaves for users' own lookups."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "geocodeTimeout",
+    registry.PositiveFloat(
+        5.0,
+        _("""Sets how long, in seconds, a postcode or reverse lookup may take."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "weatherTimeout",
+    registry.PositiveFloat(
+        5.0,
+        _("""Sets how long, in seconds, a Weatherstack request may take."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "commandTimeout",
+    registry.PositiveFloat(
+        15.0,
+        _("""Sets how long, in seconds, a whole weather command may take."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "maxConcurrentLookups",
+    registry.PositiveInteger(
+        8, _("""Sets how many weather commands are looked up at once.""")
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "maxQueuedLookups",
+    registry.NonNegativeInteger(
+        32,
+        _("""Sets how many more weather commands may wait for their turn.
+            Beyond that, commands are answered with "busy" straight away.
+            Identical commands share one place."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "maxLocations",
+    registry.PositiveInteger(
+        5,
+        _("""Sets how many ';' separated locations one weather command may ask for."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "bulkQueries",
+    registry.Boolean(
+        False,
+        _("""Should multi-location lookups use Weatherstack's bulk query
+            endpoint? This needs a Professional plan or higher; lookups fall
+            back to concurrent single queries when it is unavailable."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "geohashPrecision",
+    registry.NonNegativeInteger(
+        5,
+        _("""Sets the size of the geohash cells postcodes are grouped into for
+            weather lookups: 4 is about 39 x 20 km, 5 about 5 x 5 km and 6
+            about 1 x 0.6 km. Replies still name the postcode's own place.
+            0 looks up every postcode's place separately."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "offlineReverseGeocoding",
+    registry.Boolean(
+        True,
+        _("""Should postcodes be named from the bundled GeoNames places
+            instead of OpenWeatherMap's reverse geocoding API?"""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "offlineMaxDistance",
+    registry.PositiveInteger(
+        25,
+        _("""Sets how far away, in km, the nearest bundled place may be
+            before it is not used to name a postcode."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "reverseGeocodeFallback",
+    registry.Boolean(
+        True,
+        _("""Should OpenWeatherMap's reverse geocoding API be used when no
+            bundled place is close enough?"""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "pgeocodeCacheSize",
+    registry.PositiveInteger(
+        4,
+        _("""Sets how many countries' postcode tables are kept loaded in
+            memory."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "pgeocodePreload",
+    registry.SpaceSeparatedListOfStrings(
+        [],
+        _("""Space separated list of alpha-2 country codes whose postcode
+            tables are loaded when the plugin starts, e.g. AU GB."""),
+    ),
+)
 conf.registerGlobalValue(
     Weatherstack,
     "positionstackAPI",
@@ -72,6 +265,147 @@ conf.registerGlobalValue(
     "openweatherAPI",
     registry.String("", _("""Sets the API key for OpenWeatherMap."""), private=True),
 )
+conf.registerGlobalValue(
+    Weatherstack,
+    "requestsPerMinute",
+    registry.NonNegativeInteger(
+        0,
+        _("""Sets how many locations all users together may look up per
+            minute. 0 means unlimited."""),
+    ),
+)
+conf.registerChannelValue(
+    Weatherstack,
+    "channelRequestsPerMinute",
+    registry.NonNegativeInteger(
+        20,
+        _("""Sets how many locations may be looked up per minute in a
+            channel. 0 means unlimited."""),
+    ),
+)
+conf.registerChannelValue(
+    Weatherstack,
+    "userRequestsPerMinute",
+    registry.NonNegativeInteger(
+        5,
+        _("""Sets how many locations one user may look up per minute.
+            0 means unlimited."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "weatherstackPerSecond",
+    registry.Float(
+        0,
+        _("""Sets how many calls per second may be made to Weatherstack.
+            0 means unlimited."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "weatherstackMonthlyQuota",
+    registry.NonNegativeInteger(
+        0,
+        _("""Sets how many calls per month may be made to Weatherstack,
+            e.g. 100 on the free plan. 0 means unlimited."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "openweatherPerSecond",
+    registry.Float(
+        0,
+        _("""Sets how many calls per second may be made to OpenWeatherMap.
+            0 means unlimited."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "openweatherMonthlyQuota",
+    registry.NonNegativeInteger(
+        0,
+        _("""Sets how many calls per month may be made to OpenWeatherMap.
+            0 means unlimited."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "breakerThreshold",
+    registry.PositiveInteger(
+        5,
+        _("""Sets how many upstream failures in a row open an API's circuit
+            breaker, after which lookups fail fast instead of waiting."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "breakerCooldown",
+    registry.PositiveFloat(
+        30.0,
+        _("""Sets how long, in seconds, an open circuit breaker waits before
+            letting a trial request through."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "weatherFallback",
+    registry.Boolean(
+        False,
+        _("""Determines whether current weather is fetched from OpenWeatherMap
+            while Weatherstack is unavailable. Otherwise the last cached
+            observation is shown, marked as stale."""),
+    ),
+)
+conf.registerChannelValue(
+    Weatherstack,
+    "subscriptions",
+    Locations(
+        [],
+        _("""Sets the locations whose weather is announced in the channel
+            every subscriptionInterval seconds, separated by semicolons."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "subscriptionInterval",
+    registry.PositiveInteger(
+        1800, _("""Sets how often, in seconds, subscriptions are announced.""")
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "subscriptionConcurrency",
+    registry.PositiveInteger(
+        4,
+        _("""Sets how many subscribed locations are looked up at once. Each
+            location is looked up once per round, however many channels
+            subscribe to it."""),
+    ),
+)
+conf.registerChannelValue(
+    Weatherstack,
+    "maxSubscriptions",
+    registry.PositiveInteger(
+        10, _("""Sets how many locations a channel can subscribe to.""")
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "prometheusFile",
+    registry.String(
+        "",
+        _("""Sets a file to write lookup metrics to in the Prometheus text
+            format, e.g. for the node exporter's textfile collector. Empty
+            disables it."""),
+    ),
+)
+conf.registerGlobalValue(
+    Weatherstack,
+    "prometheusInterval",
+    registry.PositiveInteger(
+        60, _("""Sets how often, in seconds, the Prometheus file is rewritten.""")
+    ),
+)
 conf.registerChannelValue(
     Weatherstack,
     "enabled",
@@ -0,0 +1,105 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Admission control for Weatherstack commands.
+"""
+
+import asyncio
+import threading
+from collections import deque
+
+
+class Admission:
+    """
+    A bounded queue in front of the event loop.
+
+    At most `concurrency` requests run at once and `depth` more wait for a
+    slot; beyond that `submit` sheds new requests straight away instead of
+    letting them pile up. A request identical to one already admitted joins
+    it rather than taking another place in the queue.
+
+    `submit` may be called from any thread; `acquire` and `release` must
+    run on the event loop.
+    """
+
+    def __init__(self, concurrency: int = 8, depth: int = 32):
+        self.concurrency = concurrency
+        self.depth = depth
+        self._lock = threading.Lock()
+        self._admitted = {}  # key -> concurrent.futures.Future
+        self._running = 0
+        self._waiters = deque()  # asyncio futures waiting for a slot
+        self.merged = 0
+        self.shed = 0
+
+    def __len__(self):
+        """Requests admitted and not yet finished."""
+        return len(self._admitted)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return max(len(self._admitted) - self._running, 0)
+
+    def submit(self, key, start):
+        """
+        Admit a request.
+
+        Args:
+            key: Identifies identical requests.
+            start: Called, once admitted, to start the request; returns a
+                   concurrent.futures.Future.
+
+        Returns:
+            Future | None: The request's future, shared with an identical
+                           request if there is one, or None when shed.
+        """
+        with self._lock:
+            future = self._admitted.get(key)
+            if future is not None:
+                self.merged += 1
+                return future
+            if len(self._admitted) >= self.concurrency + self.depth:
+                self.shed += 1
+                return None
+            future = start()
+            self._admitted[key] = future
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    def _finish(self, key, future):
+        with self._lock:
+            if self._admitted.get(key) is future:
+                del self._admitted[key]
+
+    async def acquire(self):
+        """Wait for a running slot."""
+        if self._running < self.concurrency and not self._waiters:
+            self._running += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on.
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        """Free a running slot, handing it to the next waiter."""
+        if self._running <= self.concurrency:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self._running -= 1
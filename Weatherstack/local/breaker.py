@@ -0,0 +1,90 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Circuit breakers for the upstream APIs used by the Weatherstack plugin.
+"""
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Stop calling an upstream API that keeps failing.
+
+    After `threshold` consecutive failures the breaker opens and callers are
+    turned away at once instead of waiting out a timeout. Once `cooldown`
+    seconds have passed it lets a single trial request through (half-open):
+    success closes the breaker, failure opens it for another cooldown.
+    """
+
+    def __init__(self, name: str, threshold=5, cooldown=30.0, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the next trial request is allowed."""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(self.cooldown - (self._clock() - self._opened_at), 0.0)
+
+    def allow(self) -> bool:
+        """Ask to make a call; every allowed call must be settled with
+        `success()`, `failure()` or `release()`."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if self._clock() - self._opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self._state = HALF_OPEN
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.threshold:
+                if self._state != OPEN:
+                    self.trips += 1
+                self._state = OPEN
+                self._opened_at = self._clock()
+            self._probing = False
+
+    def release(self):
+        """Give back an allowed call that was never made."""
+        with self._lock:
+            self._probing = False
@@ -0,0 +1,118 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+In-memory caches used by the Weatherstack plugin.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A bounded LRU mapping whose entries expire after a time-to-live.
+
+    An expired entry is kept for a further `stale` seconds, so a caller can
+    answer from it straight away while it refreshes the entry in the
+    background. The cache counts fresh hits, stale hits and misses.
+    """
+
+    def __init__(self, maxsize=256, ttl=600, stale=1800, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale = stale
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (
+                self._clock() - entry[0] < self.ttl + self.stale
+            )
+
+    def lookup(self, key):
+        """
+        Look up a key.
+
+        Returns:
+            tuple | None: (value, fresh) where `fresh` is False for an entry
+                          past its TTL but still inside the stale window, or
+                          None when there is nothing usable.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            age = self._clock() - entry[0]
+            if age >= self.ttl + self.stale:
+                # Keep it: `last()` still answers from it during an outage.
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1], True
+            self.stale_hits += 1
+            return entry[1], False
+
+    def last(self, key):
+        """
+        Return the last value stored for a key however old it is, without
+        counting a hit or a miss.
+
+        Returns:
+            tuple | None: (value, age in seconds), or None if it was evicted.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            return entry[1], self._clock() - entry[0]
+
+    def set(self, key, value, age: float = 0.0):
+        """Store a value, evicting the least recently used entries. `age`
+        backdates a value that was fetched earlier, e.g. by another bot."""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self._clock() - age, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self) -> list:
+        """(key, value, age) for every entry, least recently used first."""
+        with self._lock:
+            now = self._clock()
+            return [
+                (key, value, now - stored_at)
+                for key, (stored_at, value) in self._data.items()
+            ]
+
+    def restore(self, key, value, age: float):
+        """Put back an entry that was `age` seconds old, unless it is already
+        cached or too old to be served."""
+        if self.maxsize <= 0 or age >= self.ttl + self.stale:
+            return
+        with self._lock:
+            if key in self._data:
+                return
+            self._data[key] = (self._clock() - age, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
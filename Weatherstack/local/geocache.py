@@ -0,0 +1,88 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Persistent geocoding cache for the Weatherstack plugin.
+"""
+
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS postcodes (
+    postcode TEXT NOT NULL,
+    country  TEXT NOT NULL,
+    lat      REAL NOT NULL,
+    lon      REAL NOT NULL,
+    created  REAL NOT NULL,
+    PRIMARY KEY (postcode, country)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS places (
+    lat     INTEGER NOT NULL,
+    lon     INTEGER NOT NULL,
+    name    TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (lat, lon)
+) WITHOUT ROWID;
+"""
+
+
+class GeoCache:
+    """
+    Store postcode and reverse geocoding results in SQLite.
+
+    Postcodes are keyed on (postcode, country). Reverse lookups are keyed on
+    the coordinates rounded to `precision` decimal places (3 is about 110 m).
+    The database runs in WAL mode, so it survives plugin reloads and bot
+    restarts and readers never block the writer.
+    """
+
+    def __init__(self, filename: str, precision: int = 3):
+        self._scale = 10**precision
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _grid(self, lat: float, lon: float) -> tuple[int, int]:
+        return round(lat * self._scale), round(lon * self._scale)
+
+    def get_postcode(self, postcode: str, country: str):
+        """Return the cached (lat, lon) for a postcode, or None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT lat, lon FROM postcodes WHERE postcode = ? AND country = ?",
+                (postcode.upper(), country.upper()),
+            ).fetchone()
+
+    def set_postcode(self, postcode: str, country: str, lat: float, lon: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO postcodes VALUES (?, ?, ?, ?, ?)",
+                (postcode.upper(), country.upper(), lat, lon, time.time()),
+            )
+
+    def get_place(self, lat: float, lon: float):
+        """Return the cached place name for a pair of coordinates, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT name FROM places WHERE lat = ? AND lon = ?",
+                self._grid(lat, lon),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_place(self, lat: float, lon: float, name: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?)",
+                (*self._grid(lat, lon), name, time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
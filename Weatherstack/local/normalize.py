@@ -0,0 +1,181 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Canonical forms of the locations users ask Weatherstack about.
+"""
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+try:
+    from iso3166 import countries
+except ImportError as ie:
+    raise ImportError(f"Cannot import module: {ie}")
+
+# "lat,lon" queries, which are kept as they are.
+COORDINATES = re.compile(r"\s*(-?\d{1,3}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*")
+
+# Apostrophes and periods inside a word, dropped so they do not split it:
+# "St. John's" is queried as "st johns", not "st john s".
+INTRAWORD = re.compile(r"(?<=[^\W\d_])['\u2019.](?=[^\W\d_])")
+
+# Everything but letters, digits, whitespace, the commas between parts and
+# hyphens inside a word, as in "Stratford-upon-Avon".
+PUNCTUATION = re.compile(r"(?:[^\w\s,-]|(?<![^\W\d_])-|-(?![^\W\d_]))+")
+
+# Common names ISO 3166 spells differently, safe anywhere in a query.
+COUNTRY_ALIASES = {
+    "uk": "gb",
+    "great britain": "gb",
+    "usa": "us",
+    "united states": "us",
+    "russia": "ru",
+    "south korea": "kr",
+    "north korea": "kp",
+    "vietnam": "vn",
+    "iran": "ir",
+    "syria": "sy",
+    "laos": "la",
+    "bolivia": "bo",
+    "venezuela": "ve",
+    "tanzania": "tz",
+    "moldova": "md",
+    "czech republic": "cz",
+    "czechia": "cz",
+    "taiwan": "tw",
+}
+
+# Only taken as a country after a comma: "Northern Ireland" is in GB but
+# "Belfast Northern Ireland" must not lose its last word to Ireland.
+REGION_ALIASES = {
+    "england": "gb",
+    "scotland": "gb",
+    "wales": "gb",
+    "northern ireland": "gb",
+    "britain": "gb",
+    "america": "us",
+    "holland": "nl",
+}
+
+# Country names that are just as often US states.
+AMBIGUOUS = {"georgia"}
+
+
+def fold(text: str) -> list[str]:
+    """Lowercase a location, drop punctuation and split it on commas."""
+    text = INTRAWORD.sub("", unicodedata.normalize("NFKC", text).lower())
+    text = PUNCTUATION.sub(" ", text)
+    parts = (" ".join(part.split()) for part in text.split(","))
+    return [part for part in parts if part]
+
+
+def _country_names() -> tuple[dict, dict]:
+    names, codes = dict(COUNTRY_ALIASES), {}
+    for country in countries:
+        alpha2 = country.alpha2.lower()
+        codes[alpha2] = alpha2
+        codes[country.alpha3.lower()] = alpha2
+        for name in (country.name, country.apolitical_name):
+            name = " ".join(fold(name))
+            names.setdefault(name, alpha2)
+            # "Guinea Bissau" as well as "Guinea-Bissau".
+            names.setdefault(name.replace("-", " "), alpha2)
+    for name in AMBIGUOUS:
+        names.pop(name, None)
+    return names, codes
+
+
+class LocationNormalizer:
+    """
+    Turn the many spellings of a location into one key.
+
+    "Ballarat, AU", "ballarat au" and "Ballarat,  Australia" all become
+    "ballarat, au": punctuation and whitespace are folded and a country
+    after the last comma becomes its ISO 3166 alpha-2 code. Without a comma
+    only a trailing two-letter code is split off. On top of that, an alias
+    table learns which canonical place Weatherstack answered each query
+    with, so different queries for one place share a key. Only the
+    `maxaliases` most recently used aliases are kept.
+    """
+
+    def __init__(self, maxaliases: int = 4096):
+        self.maxaliases = maxaliases
+        self._names, self._codes = _country_names()
+        self._aliases = OrderedDict()  # canonical query -> canonical place
+        self._lock = threading.Lock()
+        self.alias_hits = 0
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def _country(self, text: str, explicit: bool):
+        if explicit:
+            return (
+                self._codes.get(text)
+                or self._names.get(text)
+                or REGION_ALIASES.get(text)
+            )
+        # Without a comma only a two-letter code, or "uk", may end the text:
+        # a trailing name is too often part of the place itself, as in "New
+        # Jersey", "New Mexico" or "Western Australia".
+        if len(text) != 2:
+            return None
+        return self._codes.get(text) or COUNTRY_ALIASES.get(text)
+
+    def canonical(self, location: str) -> str:
+        """Fold a location into its canonical query, e.g. 'ballarat, au'."""
+        coordinates = COORDINATES.fullmatch(location)
+        if coordinates:
+            return "{:.4f},{:.4f}".format(*map(float, coordinates.groups()))
+        parts = fold(location)
+        if len(parts) > 1:
+            country = self._country(parts[-1], explicit=True)
+            if country:
+                parts[-1] = country
+        elif parts:
+            words = parts[0].split()
+            if len(words) > 1:
+                country = self._country(words[-1], explicit=False)
+                if country:
+                    parts = [" ".join(words[:-1]), country]
+        return ", ".join(parts)
+
+    def key(self, location: str) -> str:
+        """The cache key for a location: its learned place, if any."""
+        query = self.canonical(location)
+        with self._lock:
+            place = self._aliases.get(query)
+            if place is None:
+                return query
+            self._aliases.move_to_end(query)
+            self.alias_hits += 1
+            return place
+
+    def items(self) -> list:
+        """(query, place) for every alias, least recently used first."""
+        with self._lock:
+            return list(self._aliases.items())
+
+    def restore(self, query: str, place: str):
+        """Put back a canonical alias unless the query has a newer one."""
+        with self._lock:
+            if query not in self._aliases and len(self._aliases) < self.maxaliases:
+                self._aliases[query] = place
+
+    def learn(self, location: str, place: str) -> str:
+        """
+        Remember that a query was answered with `place`, e.g. 'Ballarat,
+        Victoria, Australia'. Returns the canonical place.
+        """
+        query, place = self.canonical(location), self.canonical(place)
+        if query and place and self.maxaliases > 0:
+            with self._lock:
+                self._aliases[query] = place
+                self._aliases.move_to_end(query)
+                while len(self._aliases) > self.maxaliases:
+                    self._aliases.popitem(last=False)
+        return place
@@ -0,0 +1,109 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Decayed query counts for Weatherstack's popular-location prefetch.
+"""
+
+import heapq
+import threading
+import time
+
+
+class DecayedCounter:
+    """
+    Count hits per key with exponential decay (a decayed-count LFU table).
+
+    A hit is worth 1 now and half that `halflife` seconds later. Rather than
+    decaying every count, each new hit is weighted by 2 ** (t / halflife) and
+    scores are divided by the current weight when read. Only `maxsize` keys
+    are kept; the least popular quarter goes when the table is full.
+    """
+
+    def __init__(self, halflife=21600.0, maxsize=1024, clock=time.monotonic):
+        self.halflife = halflife
+        self.maxsize = maxsize
+        self._clock = clock
+        self._origin = clock()
+        self._entries = {}  # key -> [weighted count, value]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _weight(self) -> float:
+        weight = 2.0 ** ((self._clock() - self._origin) / self.halflife)
+        if weight > 2.0**32:
+            # Rebase before the weighted counts lose precision.
+            for entry in self._entries.values():
+                entry[0] /= weight
+            self._origin = self._clock()
+            weight = 1.0
+        return weight
+
+    def hit(self, key, value=None):
+        """Count one hit for `key`, remembering `value` alongside it."""
+        with self._lock:
+            weight = self._weight()
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.maxsize:
+                    self._evict()
+                entry = self._entries[key] = [0.0, value]
+            entry[0] += weight
+            entry[1] = value
+
+    def _evict(self):
+        drop = heapq.nsmallest(
+            max(len(self._entries) // 4, 1),
+            self._entries,
+            key=lambda key: self._entries[key][0],
+        )
+        for key in drop:
+            del self._entries[key]
+
+    def items(self) -> list:
+        """(key, value, score) for every key."""
+        with self._lock:
+            weight = self._weight()
+            return [
+                (key, value, count / weight)
+                for key, (count, value) in self._entries.items()
+            ]
+
+    def restore(self, key, value, score: float):
+        """Add a saved score back onto a key."""
+        with self._lock:
+            weight = self._weight()
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.maxsize:
+                    return
+                entry = self._entries[key] = [0.0, value]
+            entry[0] += score * weight
+
+    def score(self, key) -> float:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] / self._weight() if entry is not None else 0.0
+
+    def top(self, n: int, min_score: float = 1.0) -> list:
+        """
+        The `n` most popular keys.
+
+        Returns:
+            list: (key, value, score) tuples, most popular first, leaving out
+                  keys whose decayed score is below `min_score`.
+        """
+        with self._lock:
+            weight = self._weight()
+            best = heapq.nlargest(n, self._entries.items(), key=lambda item: item[1][0])
+        return [
+            (key, value, count / weight)
+            for key, (count, value) in best
+            if count / weight >= min_score
+        ]
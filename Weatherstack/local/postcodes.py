@@ -0,0 +1,85 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Registry of loaded pgeocode postcode tables.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+from supybot import log
+
+
+class NominatimRegistry:
+    """
+    Keep loaded pgeocode.Nominatim instances, one per country.
+
+    Building a Nominatim parses the country's whole postcode table with
+    pandas, so instances are reused and the least recently used country is
+    evicted once more than `maxsize` are loaded. Every method blocks, so call
+    them from an executor rather than the event loop.
+    """
+
+    def __init__(self, maxsize: int = 4):
+        self.maxsize = maxsize
+        self._instances = OrderedDict()  # country -> Nominatim
+        self._lock = threading.Lock()
+        self._loading = {}  # country -> lock held while that table loads
+
+    def get(self, country: str):
+        """Return the Nominatim instance for a country, loading it if needed."""
+        country = country.upper()
+        with self._lock:
+            nomi = self._instances.get(country)
+            if nomi is not None:
+                self._instances.move_to_end(country)
+                return nomi
+            loading = self._loading.setdefault(country, threading.Lock())
+        # Load outside the registry lock so other countries stay available,
+        # but never parse the same table twice at once.
+        with loading:
+            with self._lock:
+                nomi = self._instances.get(country)
+            if nomi is None:
+                nomi = self._load(country)
+            with self._lock:
+                self._instances[country] = nomi
+                self._instances.move_to_end(country)
+                while len(self._instances) > max(self.maxsize, 1):
+                    self._instances.popitem(last=False)
+                self._loading.pop(country, None)
+        return nomi
+
+    def _load(self, country: str):
+        from pgeocode import Nominatim
+
+        return Nominatim(country)
+
+    def query(self, postcode: str, country: str):
+        """
+        Look up a postcode.
+
+        Returns:
+            tuple | None: (lat, lon), or None when the postcode is unknown.
+        """
+        zip_data = self.get(country).query_postal_code(postcode)
+        # pgeocode reports unknown postcodes as NaN.
+        if math.isnan(zip_data.latitude) or math.isnan(zip_data.longitude):
+            return None
+        return float(zip_data.latitude), float(zip_data.longitude)
+
+    def preload(self, countries):
+        """Load the postcode tables for a list of countries."""
+        for country in countries:
+            try:
+                self.get(country)
+            except Exception as e:
+                log.warning(
+                    f"Weatherstack: cannot preload postcodes for {country}: {e}"
+                )
+
+    def __contains__(self, country):
+        return country.upper() in self._instances
@@ -0,0 +1,158 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Token-bucket rate limiting for Weatherstack users and upstream APIs.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+class TokenBucket:
+    """Hold up to `capacity` tokens, refilled at `rate` tokens per second."""
+
+    __slots__ = ("rate", "capacity", "tokens", "_stamp", "_clock")
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._stamp = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def consume(self, n: float = 1) -> bool:
+        """Take `n` tokens if they are available."""
+        self._refill()
+        if self.tokens < n:
+            return False
+        self.tokens -= n
+        return True
+
+    def wait_time(self, n: float = 1) -> float:
+        """Seconds until `n` tokens will be available."""
+        self._refill()
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class RequestLimiter:
+    """
+    Per-key request budgets, e.g. one bucket per user or per channel.
+
+    Budgets are given in requests per minute and may change between calls;
+    0 means unlimited. Only the `maxkeys` most recently seen keys are kept.
+    """
+
+    def __init__(self, maxkeys: int = 1024, clock=time.monotonic):
+        self.maxkeys = maxkeys
+        self._clock = clock
+        self._buckets = OrderedDict()  # key -> TokenBucket
+        self._lock = threading.Lock()
+        self.denied = 0
+
+    def _bucket(self, key, per_minute: int) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.capacity != per_minute:
+            bucket = TokenBucket(per_minute / 60.0, per_minute, self._clock)
+            self._buckets[key] = bucket
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxkeys:
+            self._buckets.popitem(last=False)
+        return bucket
+
+    def charge(self, budgets, n: int = 1) -> float:
+        """
+        Charge `n` requests to every budget, or to none of them.
+
+        Args:
+            budgets: (key, per_minute) pairs, e.g. the global, channel and
+                     user budgets that apply to one command.
+
+        Returns:
+            float: 0.0 when charged, otherwise the seconds to wait before
+                   every budget could pay.
+        """
+        with self._lock:
+            buckets = [
+                (self._bucket(key, per_minute), min(n, per_minute))
+                for key, per_minute in budgets
+                if per_minute > 0
+            ]
+            wait = max((bucket.wait_time(cost) for bucket, cost in buckets), default=0)
+            if wait > 0:
+                self.denied += 1
+                return wait
+            for bucket, cost in buckets:
+                bucket.consume(cost)
+            return 0.0
+
+
+class Quota:
+    """
+    Guard one upstream API with a per-second bucket and a monthly allowance.
+
+    The monthly count starts again on the first day of each UTC month.
+    A rate or allowance of 0 means unlimited.
+    """
+
+    def __init__(self, name: str, clock=time.monotonic):
+        self.name = name
+        self._clock = clock
+        self._bucket = None
+        self._lock = threading.Lock()
+        self.monthly = 0
+        self.used = 0
+        self.denied = 0
+        self._month = self._this_month()
+
+    @staticmethod
+    def _this_month():
+        now = datetime.now(timezone.utc)
+        return now.year, now.month
+
+    def configure(self, per_second: float, monthly: int):
+        """Apply the current registry settings."""
+        with self._lock:
+            self.monthly = monthly
+            if per_second <= 0:
+                self._bucket = None
+            elif self._bucket is None or self._bucket.rate != per_second:
+                self._bucket = TokenBucket(
+                    per_second, max(per_second, 1.0), self._clock
+                )
+
+    @property
+    def remaining(self):
+        """Calls left this month, or None when there is no monthly limit."""
+        if self.monthly <= 0:
+            return None
+        return max(self.monthly - self.used, 0)
+
+    def acquire(self, n: int = 1) -> bool:
+        """
+        Charge `n` upstream calls, e.g. one per location of a bulk query,
+        or return False if over budget.
+        """
+        with self._lock:
+            month = self._this_month()
+            if month != self._month:
+                self._month = month
+                self.used = 0
+            if (0 < self.monthly < self.used + n) or (
+                self._bucket is not None
+                and not self._bucket.consume(min(n, self._bucket.capacity))
+            ):
+                self.denied += 1
+                return False
+            self.used += n
+            return True
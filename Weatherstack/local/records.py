@@ -0,0 +1,125 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Compact weather records decoded from upstream API responses.
+"""
+
+import copy
+from datetime import datetime, timezone
+
+try:
+    from orjson import loads  # optional, several times faster than json
+except ImportError:
+    from json import loads
+
+COMPASS_POINTS = "N NNE NE ENE E ESE SE SSE S SSW SW WSW W WNW NW NNW".split()
+
+
+def compass_point(degrees: float) -> str:
+    """Turn a wind bearing into one of the 16 compass points."""
+    return COMPASS_POINTS[round(degrees / 22.5) % 16]
+
+
+class Observation:
+    """
+    The current weather at one place, holding only the fields we display.
+
+    Text is decoded once, when the response arrives, so cached records are
+    small and formatting them is plain attribute access. `note` marks a
+    record served from a fallback, e.g. a stale cached observation.
+    """
+
+    __slots__ = (
+        "name",
+        "region",
+        "country",
+        "lat",
+        "lon",
+        "localtime",
+        "description",
+        "temperature",
+        "feelslike",
+        "humidity",
+        "precip",
+        "wind_speed",
+        "wind_dir",
+        "uv_index",
+        "note",
+    )
+
+    def __init__(self, **fields):
+        self.note = None
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_weatherstack(cls, data: dict) -> "Observation":
+        """Decode a Weatherstack current weather response."""
+        location, current = data["location"], data["current"]
+        return cls(
+            name=location["name"],
+            region=location["region"],
+            country=location["country"],
+            lat=float(location["lat"]),
+            lon=float(location["lon"]),
+            localtime=datetime.strptime(
+                location["localtime"], "%Y-%m-%d %H:%M"
+            ).strftime("%d-%m-%Y %H:%M"),
+            description=", ".join(current["weather_descriptions"]),
+            temperature=current["temperature"],
+            feelslike=current["feelslike"],
+            humidity=current["humidity"],
+            precip=current["precip"],
+            wind_speed=current["wind_speed"],
+            wind_dir=current["wind_dir"],
+            uv_index=current["uv_index"],
+        )
+
+    @classmethod
+    def from_openweather(cls, data: dict) -> "Observation":
+        """Decode an OpenWeatherMap current weather response (metric units)."""
+        local_time = datetime.fromtimestamp(
+            data["dt"] + data.get("timezone", 0), timezone.utc
+        )
+        main, wind = data["main"], data.get("wind", {})
+        return cls(
+            name=data["name"],
+            region="",
+            country=data["sys"]["country"],
+            lat=data["coord"]["lat"],
+            lon=data["coord"]["lon"],
+            localtime=local_time.strftime("%d-%m-%Y %H:%M"),
+            description=", ".join(
+                w["description"].capitalize() for w in data["weather"]
+            ),
+            temperature=round(main["temp"]),
+            feelslike=round(main["feels_like"]),
+            humidity=main["humidity"],
+            precip=data.get("rain", {}).get("1h", 0),
+            wind_speed=round(wind.get("speed", 0) * 3.6),
+            wind_dir=compass_point(wind.get("deg", 0)),
+            # OpenWeatherMap's current weather has no UV index.
+            uv_index=-1,
+        )
+
+    def fields(self) -> list:
+        """The record's values in slot order, e.g. for a snapshot."""
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_fields(cls, values: list) -> "Observation":
+        return cls(**dict(zip(cls.__slots__, values)))
+
+    def with_place(self, place: str) -> "Observation":
+        """A copy named after `place`, e.g. the postcode the user asked for."""
+        record = copy.copy(self)
+        record.name, record.region, record.country = place, "", ""
+        return record
+
+    def with_note(self, note: str) -> "Observation":
+        """A copy marked with `note`; cached records are never changed."""
+        record = copy.copy(self)
+        record.note = note
+        return record
@@ -0,0 +1,170 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Offline reverse geocoding from a bundled GeoNames cities extract.
+
+The extract (cities15000.tsv.gz: lat, lon, name, state, country code) is
+compiled once into an array-backed k-d tree file in the bot's data
+directory. That file is memory-mapped, so the tree costs almost no heap and
+a nearest-place query touches only a few dozen points.
+"""
+
+import gzip
+import math
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+MAGIC = b"WSKDTREE"
+HEADER = struct.Struct("=8sII")  # magic, number of places, padding
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _unit_vector(lat: float, lon: float) -> tuple[float, float, float]:
+    # Points on the unit sphere: no longitude wrap-around, and straight-line
+    # distance orders places exactly as great-circle distance does.
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (
+        math.cos(lat) * math.cos(lon),
+        math.cos(lat) * math.sin(lon),
+        math.sin(lat),
+    )
+
+
+def build_index(source: str, target: str):
+    """
+    Compile a gzipped TSV extract into a k-d tree file.
+
+    Places are stored in implicit k-d tree order: the median of every range
+    is its root, split on x, y and z in turn. The file holds the header, the
+    coordinates (float32 x, y, z per place), the label offsets (uint32) and
+    the UTF-8 labels.
+    """
+    points, labels = [], []
+    with gzip.open(source, "rt", encoding="utf-8") as f:
+        for line in f:
+            lat, lon, name, state, country = line.rstrip("\n").split("\t")
+            points.append(_unit_vector(float(lat), float(lon)))
+            labels.append(", ".join(part for part in (name, state, country) if part))
+
+    order = list(range(len(points)))
+    stack = [(0, len(order), 0)]
+    while stack:
+        lo, hi, depth = stack.pop()
+        if hi - lo <= 1:
+            continue
+        axis = depth % 3
+        order[lo:hi] = sorted(order[lo:hi], key=lambda i: points[i][axis])
+        mid = (lo + hi) // 2
+        stack.append((lo, mid, depth + 1))
+        stack.append((mid + 1, hi, depth + 1))
+
+    coords = array("f")
+    offsets = array("I", [0])
+    blob = bytearray()
+    for i in order:
+        coords.extend(points[i])
+        blob += labels[i].encode("utf-8")
+        offsets.append(len(blob))
+
+    tmp = f"{target}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(order), 0))
+        coords.tofile(f)
+        offsets.tofile(f)
+        f.write(blob)
+    os.replace(tmp, target)
+
+
+class ReverseGeocoder:
+    """
+    Answer nearest-place queries from the memory-mapped k-d tree.
+
+    The tree file is built from `source` on first use (or when the extract
+    is newer) and loaded lazily; `load()` blocks, so call it from an
+    executor.
+    """
+
+    def __init__(self, source: str, index: str):
+        self._source = source
+        self._index = index
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._size = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._mmap is not None
+
+    def load(self):
+        with self._lock:
+            if self._mmap is not None:
+                return
+            if not os.path.exists(self._index) or os.path.getmtime(
+                self._index
+            ) < os.path.getmtime(self._source):
+                build_index(self._source, self._index)
+            with open(self._index, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, size, _ = HEADER.unpack_from(mm)
+            if magic != MAGIC:
+                mm.close()
+                raise ValueError(f"{self._index} is not a reverse geocoding index.")
+            view = memoryview(mm)
+            start = HEADER.size
+            end = start + 12 * size
+            self._coords = view[start:end].cast("f")
+            self._offsets = view[end : end + 4 * (size + 1)].cast("I")
+            self._labels = view[end + 4 * (size + 1) :]
+            self._view = view
+            self._size = size
+            self._mmap = mm
+
+    def nearest(self, lat: float, lon: float):
+        """
+        Find the bundled place nearest to a pair of coordinates.
+
+        Returns:
+            tuple | None: (label, distance in km), or None if there are no
+                          places.
+        """
+        if self._mmap is None:
+            self.load()
+        coords = self._coords
+        query = _unit_vector(lat, lon)
+        best, best_dist = -1, float("inf")
+        stack = [(0, self._size, 0, 0.0)]
+        while stack:
+            lo, hi, depth, bound = stack.pop()
+            if lo >= hi or bound >= best_dist:
+                continue
+            mid = (lo + hi) // 2
+            x, y, z = coords[3 * mid], coords[3 * mid + 1], coords[3 * mid + 2]
+            dist = (x - query[0]) ** 2 + (y - query[1]) ** 2 + (z - query[2]) ** 2
+            if dist < best_dist:
+                best, best_dist = mid, dist
+            diff = query[depth % 3] - (x, y, z)[depth % 3]
+            near, far = (
+                ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            )
+            stack.append((*far, depth + 1, diff * diff))
+            stack.append((*near, depth + 1, 0.0))
+        if best < 0:
+            return None
+        chord = math.sqrt(best_dist)
+        distance = 2 * math.asin(min(chord / 2, 1.0)) * EARTH_RADIUS_KM
+        label = bytes(self._labels[self._offsets[best] : self._offsets[best + 1]])
+        return label.decode("utf-8"), distance
+
+    def close(self):
+        with self._lock:
+            if self._mmap is None:
+                return
+            for view in (self._coords, self._offsets, self._labels, self._view):
+                view.release()
+            self._mmap.close()
+            self._mmap = None
@@ -0,0 +1,137 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Background asyncio runtime shared by every Weatherstack lookup.
+"""
+
+import asyncio
+import threading
+
+import aiohttp
+from supybot import log
+
+
+class AsyncRuntime:
+    """
+    Run one asyncio event loop in a daemon thread for the plugin's lifetime.
+
+    The loop owns a single pooled aiohttp.ClientSession, so lookups reuse
+    keep-alive connections and cached DNS answers instead of paying for a
+    new loop, connector and handshake on every command.
+    """
+
+    def __init__(
+        self,
+        name: str = "Weatherstack",
+        headers: dict = None,
+        limit: int = 20,
+        dns_ttl: int = 300,
+        keepalive: float = 30.0,
+        timeout: float = 10.0,
+    ):
+        self._headers = headers
+        self._limit = limit
+        self._dns_ttl = dns_ttl
+        self._keepalive = keepalive
+        self._timeout = timeout
+        self._session = None
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{name} event loop", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared HTTP session. Only use this from inside the loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._limit,
+                ttl_dns_cache=self._dns_ttl,
+                keepalive_timeout=self._keepalive,
+            )
+            self._session = aiohttp.ClientSession(
+                headers=self._headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+            )
+        return self._session
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the loop and block until it finishes."""
+        return self.submit(coro).result(timeout)
+
+    async def _shutdown(self):
+        tasks = [
+            task
+            for task in asyncio.all_tasks(self.loop)
+            if task is not asyncio.current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def close(self, timeout: float = 5.0):
+        """Close the shared session, stop the loop and join its thread."""
+        if self.loop.is_closed() or not self._thread.is_alive():
+            return
+        try:
+            self.submit(self._shutdown()).result(timeout)
+        except Exception as e:
+            log.warning(f"Weatherstack: unclean event loop shutdown: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+
+class SingleFlight:
+    """
+    Let concurrent callers asking for the same key share one in-flight task.
+
+    The first caller starts the work; everyone else awaits the same task and
+    is counted in `coalesced`. Waiters are shielded, so one impatient caller
+    giving up never cancels the work for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.coalesced = 0
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, factory):
+        """Await `factory()`, or the task already running for `key`."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception retrieved in case every waiter has gone away.
+        if not task.cancelled():
+            task.exception()
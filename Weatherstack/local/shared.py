@@ -0,0 +1,139 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Weather caches shared by every bot process on a host.
+"""
+
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather (
+    key    TEXT PRIMARY KEY,
+    stored REAL NOT NULL,
+    fields TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leases (
+    key     TEXT PRIMARY KEY,
+    owner   TEXT NOT NULL,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class CacheBackend(ABC):
+    """
+    A weather cache several bot processes can use at once.
+
+    Entries are stored with the wall-clock time they were written, since
+    each process has its own monotonic clock. A lease on a key lets one
+    process refresh it while the others wait for the result.
+    """
+
+    @abstractmethod
+    def get(self, key: str):
+        """
+        Returns:
+            tuple | None: (record fields, age in seconds), or None.
+        """
+
+    @abstractmethod
+    def put(self, key: str, fields: list):
+        pass
+
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """Take the lease on a key for `ttl` seconds, unless another owner
+        holds an unexpired one."""
+
+    @abstractmethod
+    def release(self, key: str, owner: str):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Share the cache through one SQLite database in WAL mode.
+
+    Every statement commits on its own, and taking a lease is a single
+    upsert, so it is atomic across processes. Entries older than `maxage`
+    seconds are pruned now and then.
+    """
+
+    def __init__(self, filename: str, maxage: float = 86400.0):
+        self.filename = filename
+        self.maxage = maxage
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None, timeout=5.0
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored, fields FROM weather WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[1]), max(time.time() - row[0], 0.0)
+
+    def put(self, key: str, fields: list):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO weather VALUES (?, ?, ?)",
+                (key, now, json.dumps(fields, separators=(",", ":"))),
+            )
+            self._puts += 1
+            if self._puts % 256 == 0:
+                self._conn.execute(
+                    "DELETE FROM weather WHERE stored < ?", (now - self.maxage,)
+                )
+                self._conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE"
+                " SET owner = excluded.owner, expires = excluded.expires"
+                " WHERE leases.expires < ? OR leases.owner = excluded.owner",
+                (key, owner, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+BACKENDS = {"sqlite": SQLiteBackend}
+
+
+def open_backend(spec: str) -> CacheBackend:
+    """Open a backend from a 'name:location' spec, e.g. 'sqlite:/tmp/ws.db'."""
+    name, _, location = spec.partition(":")
+    if name not in BACKENDS or not location:
+        raise ValueError(
+            f"Unknown shared cache '{spec}', expected one of: "
+            + ", ".join(f"{name}:<location>" for name in BACKENDS)
+        )
+    return BACKENDS[name](location)
@@ -0,0 +1,94 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Save Weatherstack's warm in-memory state across reloads and restarts.
+
+A snapshot is a gzipped file of JSON lines: a header with the version and
+the wall-clock time it was written, then one short array per entry:
+
+    ["w", key, age, [Observation fields]]   weather cache
+    ["a", query, place]                      location alias
+    ["p", key, location, score]              query popularity
+
+Ages are stored rather than timestamps because the caches run on the
+monotonic clock, which starts again with the process.
+"""
+
+import gzip
+import json
+import os
+import time
+
+from .records import Observation
+
+VERSION = 1
+
+
+def save(filename: str, weather, normalizer, popular) -> int:
+    """
+    Write a snapshot, atomically replacing any earlier one.
+
+    Returns:
+        int: The number of entries written.
+    """
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    count = 0
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+
+        def write(entry):
+            f.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False))
+            f.write("\n")
+
+        write({"version": VERSION, "saved": time.time()})
+        for key, record, age in weather.items():
+            write(["w", key, round(age, 1), record.fields()])
+            count += 1
+        for query, place in normalizer.items():
+            write(["a", query, place])
+            count += 1
+        for key, location, score in popular.items():
+            write(["p", key, location, round(score, 3)])
+            count += 1
+    os.replace(tmp, filename)
+    return count
+
+
+def load(filename: str, weather, normalizer, popular, cancelled=None) -> int:
+    """
+    Stream a snapshot back into the caches, one entry at a time.
+
+    Entries already present are left alone, so this can run while the
+    plugin serves lookups. Blocks; call it from an executor. Stops early
+    once `cancelled()` returns True.
+
+    Returns:
+        int: The number of entries read, 0 without a usable snapshot.
+    """
+    try:
+        f = gzip.open(filename, "rt", encoding="utf-8")
+    except FileNotFoundError:
+        return 0
+    count = 0
+    with f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("version") != VERSION:
+            return 0
+        # Time spent on disk counts towards every entry's age.
+        offline = max(time.time() - header["saved"], 0.0)
+        for line in f:
+            if cancelled is not None and cancelled():
+                break
+            entry = json.loads(line)
+            kind = entry[0]
+            if kind == "w":
+                _, key, age, fields = entry
+                weather.restore(key, Observation.from_fields(fields), age + offline)
+            elif kind == "a":
+                normalizer.restore(entry[1], entry[2])
+            elif kind == "p":
+                _, key, location, score = entry
+                popular.restore(key, location, score)
+            count += 1
+    return count
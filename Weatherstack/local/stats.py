@@ -0,0 +1,138 @@
+###
+# Copyright © 2021 - 2024, Barry Suridge
+# All rights reserved.
+###
+"""
+Latency histograms and counters for the Weatherstack plugin.
+"""
+
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds of the latency buckets, in milliseconds.
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """A fixed-size latency histogram; the last bucket catches everything."""
+
+    __slots__ = ("bounds", "counts", "count", "total")
+
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = array("Q", [0] * (len(bounds) + 1))
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the pct-th percentile, in ms."""
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    """Per-stage latency histograms plus named counters."""
+
+    STAGES = (
+        "queue",
+        "pgeocode",
+        "zip",
+        "geonames",
+        "reverse",
+        "weatherstack",
+        "openweather",
+        "format",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {stage: Histogram() for stage in self.STAGES}
+
+    @contextmanager
+    def time(self, stage: str):
+        """Record how long the body of a `with` block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.histograms[stage].observe(ms)
+
+    def summary(self, counters: dict) -> str:
+        """A one-line summary for IRC."""
+        parts = []
+        with self._lock:
+            for stage, hist in self.histograms.items():
+                if not hist.count:
+                    continue
+                p50, p95, p99 = (
+                    _format_ms(hist.percentile(pct)) for pct in (50, 95, 99)
+                )
+                parts.append(
+                    f"{stage}: n={hist.count} avg {hist.total / hist.count:.1f}ms "
+                    f"p50 {p50} p95 {p95} p99 {p99}"
+                )
+        parts.append(", ".join(f"{name} {value}" for name, value in counters.items()))
+        return " | ".join(parts)
+
+    def prometheus(self, counters: dict, gauges: dict) -> str:
+        """Render everything in the Prometheus text exposition format."""
+        lines = [
+            "# HELP weatherstack_stage_latency_seconds Latency of each lookup stage.",
+            "# TYPE weatherstack_stage_latency_seconds histogram",
+        ]
+        with self._lock:
+            for stage, hist in self.histograms.items():
+                cumulative = 0
+                for bound, n in zip(hist.bounds, hist.counts):
+                    cumulative += n
+                    lines.append(
+                        f'weatherstack_stage_latency_seconds_bucket{{stage="{stage}",'
+                        f'le="{bound / 1000}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'weatherstack_stage_latency_seconds_bucket{{stage="{stage}",'
+                    f'le="+Inf"}} {hist.count}'
+                )
+                lines.append(
+                    f'weatherstack_stage_latency_seconds_sum{{stage="{stage}"}} '
+                    f"{hist.total / 1000}"
+                )
+                lines.append(
+                    f'weatherstack_stage_latency_seconds_count{{stage="{stage}"}} '
+                    f"{hist.count}"
+                )
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name, value in values.items():
+                suffix = "_total" if kind == "counter" else ""
+                lines.append(f"# TYPE weatherstack_{name}{suffix} {kind}")
+                lines.append(f"weatherstack_{name}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filename: str, counters: dict, gauges: dict):
+        """Atomically rewrite a node exporter textfile."""
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus(counters, gauges))
+        os.replace(tmp, filename)
+
+
+def _format_ms(ms: float) -> str:
+    return f">{BUCKETS_MS[-1]}ms" if ms == float("inf") else f"<={ms:g}ms"
@@ -3,10 +3,11 @@
 # All rights reserved.
 ###
 import math
+import os
 import re
-from datetime import datetime
+import sqlite3
 from functools import lru_cache
-from supybot import callbacks, ircutils, log
+from supybot import callbacks, conf, ircmsgs, ircutils, log, world
 from supybot.commands import *
 
 try:
@@ -23,11 +24,41 @@ try:
 except ImportError as ie:
     raise ImportError(f"Cannot import module: {ie}")
 
+from .local.admission import Admission
+from .local.breaker import CircuitBreaker
+from .local.cache import TTLCache
+from .local import geohash
+from .local.geocache import GeoCache
+from .local.normalize import COORDINATES, LocationNormalizer
+from .local.popularity import DecayedCounter
+from .local.postcodes import NominatimRegistry
+from .local.ratelimit import Quota, RequestLimiter
+from .local.records import Observation, loads
+from .local.reverse import ReverseGeocoder
+from .local.runtime import AsyncRuntime, SingleFlight
+from .local import snapshot
+from .local.shared import SQLiteBackend, open_backend
+from .local.stats import Metrics
+
 # Unicode Symbols
 APOSTROPHE = "\N{APOSTROPHE}"
 DEGREE_SIGN = "\N{DEGREE SIGN}"
 PERCENT_SIGN = "\N{PERCENT SIGN}"
 QUOTATION_MARK = "\N{QUOTATION MARK}"
+
+# Upstream endpoints
+WEATHERSTACK_URL = "http://api.weatherstack.com/current"
+OPENWEATHER_WEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
+OPENWEATHER_ZIP_URL = "http://api.openweathermap.org/geo/1.0/zip"
+OPENWEATHER_REVERSE_URL = "http://api.openweathermap.org/geo/1.0/reverse"
+# Popular-location prefetch: how often to look, and how long before expiry
+# an entry is refreshed.
+PREFETCH_INTERVAL = 15
+PREFETCH_LEAD = 45
+
+# How often to check whether another bot has finished a shared refresh.
+SHARED_POLL = 0.1
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; Linux i686; rv:110.0) Gecko/20100101 Firefox/110.0"
 }
@@ -40,6 +71,18 @@ def handle_error(error: Exception, context: str = None):
     raise callbacks.Error(f"An error occurred: {str(error)}")
 
 
+class UpstreamError(callbacks.Error):
+    """An upstream API is down, unreachable or too slow to answer."""
+
+
+async def with_timeout(awaitable, timeout: float, stage: str):
+    """Await something, turning a timeout into an error naming the stage."""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise UpstreamError(f"{stage} timed out after {timeout} seconds.")
+
+
 def contains_number(value) -> bool:
     """Check if a string contains a number."""
     if not isinstance(value, str):
@@ -118,6 +161,160 @@ class Weatherstack(callbacks.Plugin):
 
     def __init__(self, irc):
         super().__init__(irc)
+        # One event loop and one pooled HTTP session for the plugin's lifetime.
+        self._runtime = AsyncRuntime(headers=HEADERS)
+        self._metrics = Metrics()
+        self._weather_cache = TTLCache()
+        # Equivalent spellings of a location share one cache key.
+        self._normalizer = LocationNormalizer()
+        self._refreshing = {}  # cache key -> background refresh task
+        # How often each location is asked for, to keep the hot ones cached.
+        self._popular = DecayedCounter()
+        self._prefetched = 0
+        # Identical concurrent lookups share one upstream request.
+        self._flights = SingleFlight()
+        # Bounds the commands running and waiting; sheds the rest.
+        self._admission = Admission()
+        # Budgets for our users and for the upstream APIs we spend quota on.
+        self._limiter = RequestLimiter()
+        self._quotas = {
+            "weatherstack": Quota("Weatherstack"),
+            "openweather": Quota("OpenWeather"),
+        }
+        self._breakers = {
+            "weatherstack": CircuitBreaker("Weatherstack"),
+            "openweather": CircuitBreaker("OpenWeather"),
+        }
+        # Geocoding results never change, so keep them across reloads.
+        # Weather and geocoding results can be shared with other bots on this
+        # host; only one of them refreshes a key at a time.
+        self._shared = None
+        self._owner = f"{os.getpid()}:{id(self)}"
+        geocache = conf.supybot.directories.data.dirize("Weatherstack.db")
+        spec = self.registryValue("sharedCache")
+        if spec:
+            try:
+                self._shared = open_backend(spec)
+            except (ValueError, sqlite3.Error) as e:
+                log.error(f"Weatherstack: cannot open shared cache: {e}")
+        if isinstance(self._shared, SQLiteBackend):
+            geocache = self._shared.filename
+        self._geocache = GeoCache(geocache)
+        self._nominatim = NominatimRegistry(self.registryValue("pgeocodeCacheSize"))
+        self._runtime.submit(self._export_metrics())
+        self._runtime.submit(self._prefetch_popular())
+        self._runtime.submit(self._announce_subscriptions())
+        self._announced = 0
+        # Warm state from before the last reload, streamed in the background.
+        self._snapshot = conf.supybot.directories.data.dirize(
+            "Weatherstack-snapshot.jsonl.gz"
+        )
+        self._dying = False
+        self._restore = self._runtime.submit(self._restore_snapshot())
+        preload = self.registryValue("pgeocodePreload")
+        if preload:
+            self._runtime.submit(self._preload_postcodes(preload))
+        # Bundled GeoNames places, compiled into a k-d tree on first use.
+        self._reverse = ReverseGeocoder(
+            os.path.join(os.path.dirname(__file__), "local", "cities15000.tsv.gz"),
+            conf.supybot.directories.data.dirize("Weatherstack-cities15000.kdtree"),
+        )
+
+    def die(self):
+        # A half-restored snapshot would overwrite the full one.
+        restored = self._restore.done()
+        self._dying = True
+        self._runtime.close()
+        if restored and self.registryValue("cacheSnapshot"):
+            self._save_snapshot()
+        self._geocache.close()
+        if self._shared is not None:
+            self._shared.close()
+        self._reverse.close()
+        log.info(f"Weatherstack: {self._metrics.summary(self._counters())}")
+        super().die()
+
+    def _save_snapshot(self):
+        try:
+            count = snapshot.save(
+                self._snapshot, self._weather_cache, self._normalizer, self._popular
+            )
+        except OSError as e:
+            log.warning(f"Weatherstack: cannot save {self._snapshot}: {e}")
+        else:
+            log.info(f"Weatherstack: saved {count} cache entries.")
+
+    async def _restore_snapshot(self):
+        if not self.registryValue("cacheSnapshot"):
+            return
+        self._configure_cache()
+        loop = asyncio.get_running_loop()
+        try:
+            count = await loop.run_in_executor(
+                None,
+                snapshot.load,
+                self._snapshot,
+                self._weather_cache,
+                self._normalizer,
+                self._popular,
+                lambda: self._dying,
+            )
+        except Exception as e:
+            log.warning(f"Weatherstack: cannot restore {self._snapshot}: {e}")
+        else:
+            log.info(f"Weatherstack: restored {count} cache entries.")
+
+    def _counters(self) -> dict:
+        """Running totals for the stats command and the Prometheus file."""
+        cache = self._weather_cache
+        counters = {
+            "cache_hits": cache.hits,
+            "cache_stale_hits": cache.stale_hits,
+            "cache_misses": cache.misses,
+            "alias_hits": self._normalizer.alias_hits,
+            "coalesced": self._flights.coalesced,
+            "rate_limited": self._limiter.denied,
+            "admission_merged": self._admission.merged,
+            "admission_shed": self._admission.shed,
+            "prefetched": self._prefetched,
+            "announced": self._announced,
+        }
+        for api, quota in self._quotas.items():
+            counters[f"{api}_calls"] = quota.used
+            counters[f"{api}_quota_denied"] = quota.denied
+        for api, breaker in self._breakers.items():
+            counters[f"{api}_breaker_trips"] = breaker.trips
+            counters[f"{api}_breaker_rejected"] = breaker.rejected
+        return counters
+
+    def _gauges(self) -> dict:
+        gauges = {
+            "cache_entries": len(self._weather_cache),
+            "popular_locations": len(self._popular),
+            "admission_running": self._admission.running,
+            "admission_queued": self._admission.queued,
+            "location_aliases": len(self._normalizer),
+        }
+        for api, breaker in self._breakers.items():
+            gauges[f"{api}_breaker_open"] = int(breaker.state != "closed")
+        for api, quota in self._quotas.items():
+            if quota.remaining is not None:
+                gauges[f"{api}_quota_remaining"] = quota.remaining
+        return gauges
+
+    async def _export_metrics(self):
+        """Rewrite the Prometheus textfile every prometheusInterval seconds."""
+        while True:
+            await asyncio.sleep(self.registryValue("prometheusInterval"))
+            filename = self.registryValue("prometheusFile")
+            if not filename:
+                continue
+            try:
+                self._metrics.write_prometheus(
+                    filename, self._counters(), self._gauges()
+                )
+            except OSError as e:
+                log.warning(f"Weatherstack: cannot write {filename}: {e}")
 
     ### Internal Helper Functions ###
     def _parse_postcode(self, code: str) -> tuple[str, str]:
@@ -146,6 +343,117 @@ class Weatherstack(callbacks.Plugin):
 
         return postcode, countrycode
 
+    async def _preload_postcodes(self, countries: list[str]):
+        """Load pgeocode tables in the background so first lookups are fast."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._nominatim.preload, countries)
+
+    def _charge_budgets(self, irc, msg, cost: int) -> float:
+        """
+        Charge a command to the global, channel and user request budgets.
+
+        Returns:
+            float: 0.0 if the command may go ahead, otherwise the seconds the
+                   caller should wait.
+        """
+        channel, network = msg.channel, irc.network
+        budgets = [
+            ("global", self.registryValue("requestsPerMinute")),
+            (
+                ("user", network, msg.host),
+                self.registryValue("userRequestsPerMinute", channel, network),
+            ),
+        ]
+        if channel:
+            budgets.append(
+                (
+                    ("channel", network, channel),
+                    self.registryValue("channelRequestsPerMinute", channel, network),
+                )
+            )
+        return self._limiter.charge(budgets, cost)
+
+    def _acquire_quota(self, api: str, cost: int = 1):
+        """Charge `cost` calls to an upstream API, failing fast when over budget."""
+        quota = self._quotas[api]
+        quota.configure(
+            self.registryValue(f"{api}PerSecond"),
+            self.registryValue(f"{api}MonthlyQuota"),
+        )
+        if not quota.acquire(cost):
+            raise callbacks.Error(
+                f"The {quota.name} API quota is used up, try again later."
+            )
+
+    async def _get_json(
+        self, api: str, stage: str, url: str, params: dict, action: str, cost: int = 1
+    ):
+        """
+        GET a JSON document from an upstream API behind its circuit breaker,
+        charging `cost` calls to its quota.
+
+        Connection failures, timeouts and server errors count against the
+        breaker and raise UpstreamError; while the breaker is open calls fail
+        at once.
+        """
+        breaker = self._breakers[api]
+        breaker.threshold = self.registryValue("breakerThreshold")
+        breaker.cooldown = self.registryValue("breakerCooldown")
+        if not breaker.allow():
+            raise UpstreamError(
+                f"The {breaker.name} API is unavailable, retrying in "
+                f"{math.ceil(breaker.retry_after())} seconds."
+            )
+        try:
+            self._acquire_quota(api, cost)
+        except callbacks.Error:
+            breaker.release()
+            raise
+        try:
+            with self._metrics.time(stage):
+                async with self._runtime.session.get(url, params=params) as response:
+                    status = response.status
+                    data = loads(await response.read()) if status == 200 else None
+        except asyncio.CancelledError:
+            # Usually with_timeout giving up on a hung upstream.
+            breaker.failure()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            breaker.failure()
+            log.error(f"Error: {e} | Context: {breaker.name} API")
+            raise UpstreamError(f"Failed to {action}: {e or type(e).__name__}")
+        if status >= 500:
+            breaker.failure()
+            log.error(f"Error: {status} | Context: {breaker.name} API")
+            raise UpstreamError(f"Failed to {action}: {status}")
+        breaker.success()
+        if status != 200:
+            handle_error(f"Failed to {action}: {status}", f"{breaker.name} API")
+        return data
+
+    def _cache_key(self, location: str) -> str:
+        """Normalise a location into a weather cache key."""
+        return self._normalizer.key(location)
+
+    def _store_weather(
+        self, location: str, record: Observation, age: float = 0.0
+    ) -> str:
+        """Cache a record under the place Weatherstack answered with."""
+        place = self._normalizer.learn(
+            location,
+            ", ".join(
+                part for part in (record.name, record.region, record.country) if part
+            ),
+        )
+        self._weather_cache.set(place, record, age)
+        return place
+
+    def _configure_cache(self):
+        """Pick up cache settings changed in the registry since the last call."""
+        self._weather_cache.maxsize = self.registryValue("cacheSize")
+        self._weather_cache.ttl = self.registryValue("cacheTTL")
+        self._weather_cache.stale = self.registryValue("cacheStaleTTL")
+
     async def get_location_by_coordinates(self, lat: float, lon: float) -> str:
         """
         Get a location name from latitude and longitude using reverse geocoding.
@@ -157,24 +465,31 @@ class Weatherstack(callbacks.Plugin):
         Returns:
             str: A human-readable location name.
         """
+        location = self._geocache.get_place(lat, lon)
+        if location is not None:
+            return location
+
+        location = await self._reverse_geocode_offline(lat, lon)
+        if location is not None:
+            self._geocache.set_place(lat, lon, location)
+            return location
+        if not self.registryValue("reverseGeocodeFallback"):
+            raise callbacks.Error(
+                f"No location data found for coordinates ({lat}, {lon})."
+            )
+
         apikey = self.registryValue("openweatherAPI")
         if not apikey:
             raise callbacks.Error("OpenWeather API key is missing.")
 
-        url = f"http://api.openweathermap.org/geo/1.0/reverse"
         params = {"lat": lat, "lon": lon, "appid": apikey}
-
-        try:
-            async with aiohttp.ClientSession(headers=HEADERS) as session:
-                async with session.get(url, params=params) as response:
-                    if response.status != 200:
-                        handle_error(
-                            f"Failed to reverse geocode coordinates: {response.status}",
-                            "Reverse Geocoding",
-                        )
-                    data = await response.json()
-        except Exception as e:
-            handle_error(e, "get_location_by_coordinates")
+        data = await self._get_json(
+            "openweather",
+            "reverse",
+            OPENWEATHER_REVERSE_URL,
+            params,
+            "reverse geocode coordinates",
+        )
 
         if not data:
             raise callbacks.Error(
@@ -187,108 +502,646 @@ class Weatherstack(callbacks.Plugin):
         if "country" in data[0]:
             location += f", {data[0]['country']}"
 
+        self._geocache.set_place(lat, lon, location)
         return location
 
+    async def _reverse_geocode_offline(self, lat: float, lon: float):
+        """Name the nearest bundled place, if it is close enough to count."""
+        if not self.registryValue("offlineReverseGeocoding"):
+            return None
+        try:
+            with self._metrics.time("geonames"):
+                if self._reverse.loaded:
+                    nearest = self._reverse.nearest(lat, lon)
+                else:
+                    # The first query builds and maps the tree; keep that off the loop.
+                    loop = asyncio.get_running_loop()
+                    nearest = await loop.run_in_executor(
+                        None, self._reverse.nearest, lat, lon
+                    )
+        except Exception as e:
+            log.warning(f"Weatherstack: offline reverse geocoding failed: {e}")
+            return None
+        if nearest is None or nearest[1] > self.registryValue("offlineMaxDistance"):
+            return None
+        return nearest[0]
+
     ### API Integration Functions ###
     async def query_postal_code(self, code: str) -> list[float]:
         """Resolve latitude and longitude from a postcode using pgeocode."""
         postcode, countrycode = self._parse_postcode(code)
+        cached = self._geocache.get_postcode(postcode, countrycode)
+        if cached is not None:
+            return list(cached)
+        self._nominatim.maxsize = self.registryValue("pgeocodeCacheSize")
         try:
-            from pgeocode import Nominatim
-
-            nomi = Nominatim(countrycode)
-            zip_data = nomi.query_postal_code(postcode)
-            if zip_data.latitude is None or zip_data.longitude is None:
+            # pandas blocks, so keep it off the event loop.
+            loop = asyncio.get_running_loop()
+            with self._metrics.time("pgeocode"):
+                coords = await loop.run_in_executor(
+                    None, self._nominatim.query, postcode, countrycode
+                )
+            if coords is None:
                 raise ValueError("Incomplete data from pgeocode.")
-            return [zip_data.latitude, zip_data.longitude]
+            coords = list(coords)
         except Exception:
             log.warning(
                 f"Falling back to OpenWeather API for '{postcode}, {countrycode}'."
             )
-            return await self.query_postal_code_openweather(code)
+            coords = await self.query_postal_code_openweather(code)
+        self._geocache.set_postcode(postcode, countrycode, *coords)
+        return coords
 
     async def query_postal_code_openweather(self, code: str) -> list[float]:
         """Fallback: Use OpenWeather Geocoding API to resolve postcode."""
         apikey = self.registryValue("openweatherAPI")
         if not apikey:
             raise callbacks.Error("OpenWeather API key is missing.")
-        url = "http://api.openweathermap.org/geo/1.0/zip"
         params = {"zip": code, "appid": apikey}
-        async with aiohttp.ClientSession(headers=HEADERS) as session:
-            async with session.get(url, params=params) as response:
-                if response.status != 200:
-                    handle_error(
-                        f"Failed to resolve postcode: {response.status}",
-                        "OpenWeather Geocoding",
-                    )
-                data = await response.json()
+        data = await self._get_json(
+            "openweather", "zip", OPENWEATHER_ZIP_URL, params, "resolve postcode"
+        )
         return [data["lat"], data["lon"]]
 
-    async def fetch_weather(self, location: str) -> dict:
+    async def fetch_weather(self, location: str) -> Observation:
+        """
+        Fetch weather data for a location, answering from the cache if possible.
+
+        A stale entry is returned immediately and refreshed in the background.
+        """
+        self._configure_cache()
+        key = self._cache_key(location)
+        cached = self._weather_cache.lookup(key)
+        if cached is not None:
+            data, fresh = cached
+            if not fresh:
+                self._refresh_weather(key, location)
+            self._popular.hit(key, location)
+            return data
+        try:
+            data = await self._fetch_and_cache(key, location)
+        except UpstreamError as e:
+            return await self._weather_fallback(key, location, e)
+        # Count it under the place Weatherstack answered with.
+        self._popular.hit(self._cache_key(location), location)
+        return data
+
+    async def _weather_fallback(self, key: str, location: str, error: Exception):
+        """
+        Answer while Weatherstack is unavailable: from OpenWeatherMap if
+        `weatherFallback` is on, otherwise from the last cached observation,
+        marked as stale. Re-raises `error` when neither can answer.
+        """
+        if self.registryValue("weatherFallback") and self.registryValue(
+            "openweatherAPI"
+        ):
+            try:
+                data = await with_timeout(
+                    self.fetch_weather_openweather(location),
+                    self.registryValue("weatherTimeout"),
+                    "OpenWeatherMap",
+                )
+                return data.with_note("Weatherstack unavailable, via OpenWeatherMap")
+            except callbacks.Error as e:
+                log.warning(f"Weatherstack: fallback weather for '{key}' failed: {e}")
+        last = self._weather_cache.last(key)
+        if last is None:
+            raise error
+        data, age = last
+        if age < 3600:
+            age = f"{max(round(age / 60), 1)} min"
+        else:
+            age = f"{age / 3600:.1f} h"
+        return data.with_note(f"Stale: observed {age} ago, Weatherstack unavailable")
+
+    async def _fetch_and_cache(self, key: str, location: str) -> Observation:
+        """Fetch and cache a location, sharing any request already in flight."""
+        # The shared backend may block on another bot's write lock, so keep
+        # it off the event loop.
+        loop = asyncio.get_running_loop()
+
+        async def fetch():
+            if self._shared is not None:
+                shared = await self._fetch_shared(key)
+                if shared is not None:
+                    record, age = shared
+                    self._store_weather(location, record, age)
+                    return record
+            try:
+                data = await with_timeout(
+                    self.fetch_weather_upstream(location),
+                    self.registryValue("weatherTimeout"),
+                    "Weatherstack",
+                )
+                place = self._store_weather(location, data)
+                if self._shared is not None:
+                    for shared_key in {key, place}:
+                        await loop.run_in_executor(
+                            None, self._shared.put, shared_key, data.fields()
+                        )
+            finally:
+                if self._shared is not None:
+                    await loop.run_in_executor(
+                        None, self._shared.release, key, self._owner
+                    )
+            return data
+
+        return await self._flights.do(("weather", key), fetch)
+
+    async def _fetch_shared(self, key: str):
+        """
+        Look for a fresh copy of a key written by any bot on this host.
+
+        Without one, take the key's lease and return None so the caller
+        fetches it; if another bot holds the lease, wait for its result.
+        The backend is called from the executor, as it may block.
+
+        Returns:
+            tuple | None: (Observation, age in seconds), or None.
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.registryValue("weatherTimeout")
+        deadline = loop.time() + timeout
+        while True:
+            cached = await loop.run_in_executor(None, self._shared.get, key)
+            if cached is not None and cached[1] < self._weather_cache.ttl:
+                fields, age = cached
+                return Observation.from_fields(fields), age
+            acquired = await loop.run_in_executor(
+                None, self._shared.acquire, key, self._owner, timeout + SHARED_POLL
+            )
+            if acquired:
+                return None
+            if loop.time() >= deadline:
+                # The other bot is stuck; its lease expires soon anyway.
+                return None
+            await asyncio.sleep(SHARED_POLL)
+
+    def _refresh_weather(self, key: str, location: str):
+        """Refresh a stale cache entry without making the caller wait."""
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                await self._fetch_and_cache(key, location)
+            except Exception as e:
+                log.warning(f"Weatherstack: background refresh of '{key}' failed: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    async def _prefetch_popular(self):
+        """Keep the most popular locations cached; runs for the plugin's life."""
+        while True:
+            await asyncio.sleep(PREFETCH_INTERVAL)
+            try:
+                self._prefetch_once()
+            except Exception as e:
+                log.warning(f"Weatherstack: prefetch failed: {e}")
+
+    def _prefetch_once(self) -> int:
+        """
+        Refresh the top `prefetchSize` locations whose cache entries expire
+        within the next PREFETCH_LEAD seconds, as far as the Weatherstack
+        quota allows. Must run on the event loop.
+
+        Returns:
+            int: The number of refreshes started.
+        """
+        size = self.registryValue("prefetchSize")
+        self._configure_cache()
+        ttl = self._weather_cache.ttl
+        if not size or ttl <= 0 or self._breakers["weatherstack"].state != "closed":
+            return 0
+        quota = self._quotas["weatherstack"]
+        per_second = self.registryValue("weatherstackPerSecond")
+        quota.configure(per_second, self.registryValue("weatherstackMonthlyQuota"))
+        # Leave the users a share of the monthly quota and most of the
+        # per-second rate.
+        reserve = quota.monthly * self.registryValue("prefetchQuotaReserve")
+        budget = max(int(per_second), 1) if per_second > 0 else size
+        lead = min(PREFETCH_LEAD, ttl / 2)
+        started = 0
+        for key, location, _ in self._popular.top(size):
+            if started >= budget or (
+                quota.remaining is not None and quota.remaining - started <= reserve
+            ):
+                break
+            last = self._weather_cache.last(key)
+            if key in self._refreshing or (last is not None and last[1] < ttl - lead):
+                continue
+            self._refresh_weather(key, location)
+            started += 1
+        self._prefetched += started
+        return started
+
+    async def _announce_subscriptions(self):
+        """Announce subscribed locations; runs for the plugin's life."""
+        while True:
+            await asyncio.sleep(self.registryValue("subscriptionInterval"))
+            try:
+                await self._announce_once()
+            except Exception as e:
+                log.warning(f"Weatherstack: announcing subscriptions failed: {e}")
+
+    def _subscribers(self) -> dict:
+        """Group every subscribed channel on every network by location."""
+        # cache key -> (location, {(irc, channel): None, ...}); a dict keeps
+        # the channels in order and each only once, however many spellings of
+        # the place it subscribed to.
+        subscribers = {}
+        for irc in world.ircs:
+            for channel in irc.state.channels:
+                if not self.registryValue("enabled", channel, irc.network):
+                    continue
+                for location in self.registryValue(
+                    "subscriptions", channel, irc.network
+                ):
+                    key = self._cache_key(location)
+                    subscribers.setdefault(key, (location, {}))[1][
+                        (irc, channel)
+                    ] = None
+        return subscribers
+
+    async def _announce_once(self) -> int:
+        """
+        Look up every subscribed location once, a few at a time, and send each
+        result to all of its channels. Must run on the event loop.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        semaphore = asyncio.Semaphore(self.registryValue("subscriptionConcurrency"))
+        timeout = self.registryValue("commandTimeout")
+
+        async def announce(location, targets):
+            async with semaphore:
+                try:
+                    record = await with_timeout(
+                        self.lookup_weather(location), timeout, "Weather lookup"
+                    )
+                except callbacks.Error as e:
+                    log.warning(f"Weatherstack: cannot announce '{location}': {e}")
+                    return 0
+            line = self.format_weather_output(record)
+            for irc, channel in targets:
+                irc.queueMsg(ircmsgs.privmsg(channel, line))
+            return len(targets)
+
+        sent = await asyncio.gather(
+            *(
+                announce(location, targets)
+                for location, targets in self._subscribers().values()
+            )
+        )
+        self._announced += sum(sent)
+        return sum(sent)
+
+    async def fetch_weather_upstream(self, location: str) -> Observation:
         """Fetch weather data from WeatherStack."""
+        data = await self._query_weatherstack(location)
+        # Weatherstack reports API errors with a 200 status; never cache them.
+        if "error" in data:
+            handle_error(data["error"].get("info", "Unknown error"), "WeatherStack API")
+        return Observation.from_weatherstack(data)
+
+    async def fetch_weather_openweather(self, location: str) -> Observation:
+        """Fetch current weather from OpenWeatherMap."""
+        apikey = self.registryValue("openweatherAPI")
+        if not apikey:
+            raise callbacks.Error("OpenWeather API key is missing.")
+        params = {"units": "metric", "appid": apikey}
+        coordinates = COORDINATES.fullmatch(location)
+        if coordinates:
+            # e.g. a postcode's geohash cell; q= would take it for a city name.
+            params["lat"], params["lon"] = coordinates.groups()
+        else:
+            params["q"] = location
+        data = await self._get_json(
+            "openweather",
+            "openweather",
+            OPENWEATHER_WEATHER_URL,
+            params,
+            "fetch weather",
+        )
+        return Observation.from_openweather(data)
+
+    async def fetch_weather_bulk(self, locations: list[str]) -> list:
+        """
+        Fetch several locations with one WeatherStack bulk query.
+
+        Bulk queries need a Professional plan or higher; any API error is
+        raised so the caller can fall back to single queries.
+
+        Returns:
+            list: An Observation per location, or None where that location
+                  failed.
+        """
+        # Weatherstack bills a bulk query per location.
+        data = await self._query_weatherstack(";".join(locations), len(locations))
+        if isinstance(data, dict) and "error" in data:
+            raise callbacks.Error(data["error"].get("info", "Unknown error"))
+        if not isinstance(data, list) or len(data) != len(locations):
+            raise callbacks.Error("Unexpected bulk query response.")
+        return [
+            None if "error" in item else Observation.from_weatherstack(item)
+            for item in data
+        ]
+
+    async def _query_weatherstack(self, query: str, cost: int = 1):
         apikey = self.registryValue("weatherstackAPI")
         if not apikey:
             raise callbacks.Error("Weatherstack API key is missing.")
-        url = "http://api.weatherstack.com/current"
-        params = {"access_key": apikey, "query": location, "units": "m"}
-        async with aiohttp.ClientSession(headers=HEADERS) as session:
-            async with session.get(url, params=params) as response:
-                if response.status != 200:
-                    handle_error(
-                        f"Failed to fetch weather: {response.status}",
-                        "WeatherStack API",
-                    )
-                return await response.json()
+        params = {"access_key": apikey, "query": query, "units": "m"}
+        return await self._get_json(
+            "weatherstack",
+            "weatherstack",
+            WEATHERSTACK_URL,
+            params,
+            "fetch weather",
+            cost,
+        )
+
+    async def resolve_location(self, location: str) -> tuple[str, str]:
+        """
+        Turn a postcode into a query Weatherstack understands.
+
+        With `geohashPrecision` set, the query is the centre of the postcode's
+        geohash cell, so neighbouring postcodes share one weather lookup.
+
+        Returns:
+            tuple: (query, place name to show instead of Weatherstack's, or
+                   None).
+        """
+        if not contains_number(location):
+            return location, None
+        timeout = self.registryValue("geocodeTimeout")
+        lat, lon = await with_timeout(
+            self.query_postal_code(location), timeout, "Postcode lookup"
+        )
+        place = await with_timeout(
+            self.get_location_by_coordinates(lat, lon), timeout, "Reverse geocoding"
+        )
+        precision = self.registryValue("geohashPrecision")
+        if not precision:
+            return place, None
+        lat, lon = geohash.centre(geohash.encode(lat, lon, precision))
+        return f"{lat:.4f},{lon:.4f}", place
+
+    async def lookup_weather(self, location: str) -> Observation:
+        """
+        Resolve a town, city or postcode and fetch its current weather.
+
+        Concurrent lookups of the same location share one in-flight lookup.
+        """
+        return await self._flights.do(
+            ("lookup", self._cache_key(location)),
+            lambda: self._lookup_weather(location),
+        )
+
+    async def _lookup_weather(self, location: str) -> Observation:
+        query, place = await self.resolve_location(location)
+        record = await self.fetch_weather(query)
+        return record.with_place(place) if place else record
+
+    async def lookup_many(self, locations: list[str]) -> list:
+        """
+        Look up several locations concurrently.
+
+        Returns:
+            list: One weather response or exception per location, in order.
+        """
+        queries = await asyncio.gather(
+            *(self.resolve_location(location) for location in locations),
+            return_exceptions=True,
+        )
+        if self.registryValue("bulkQueries"):
+            await self._warm_cache_bulk(
+                [query[0] for query in queries if isinstance(query, tuple)]
+            )
+
+        async def fetch(query):
+            if isinstance(query, Exception):
+                raise query
+            query, place = query
+            record = await self.fetch_weather(query)
+            return record.with_place(place) if place else record
+
+        return await asyncio.gather(
+            *(fetch(query) for query in queries), return_exceptions=True
+        )
+
+    async def _warm_cache_bulk(self, queries: list[str]):
+        """Fetch uncached queries in one bulk request, if the plan allows it."""
+        self._configure_cache()
+        missing = {}
+        for query in queries:
+            key = self._cache_key(query)
+            if key not in self._weather_cache:
+                missing.setdefault(key, query)
+        if len(missing) < 2:
+            return
+        try:
+            results = await self.fetch_weather_bulk(list(missing.values()))
+        except Exception as e:
+            log.warning(f"Weatherstack: bulk query failed, using single queries: {e}")
+            return
+        for query, record in zip(missing.values(), results):
+            if record is not None:
+                self._store_weather(query, record)
 
     ### Formatting Functions ###
-    def format_weather_output(self, response: dict) -> str:
+    def format_weather_output(self, record: Observation) -> str:
         """Format weather data for display."""
-        location = response.get("location", {})
-        current = response.get("current", {})
-        coords = self.format_coordinates(location)
-        weather = self.format_current_conditions(current)
-        local_time = datetime.strptime(
-            location["localtime"], "%Y-%m-%d %H:%M"
-        ).strftime("%d-%m-%Y %H:%M")
-        return f"{location['name']}, {location['region']}, {location['country']} | {coords} | {local_time} | {weather}"
-
-    def format_coordinates(self, location: dict) -> str:
+        coords = self.format_coordinates(record)
+        weather = self.format_current_conditions(record)
+        place = ", ".join(
+            part for part in (record.name, record.region, record.country) if part
+        )
+        output = f"{place} | {coords} | {record.localtime} | {weather}"
+        if record.note:
+            output += f" | {ircutils.bold(record.note)}"
+        return output
+
+    def format_compact_output(self, record: Observation) -> str:
+        """Format weather data as one short entry of a multi-location reply."""
+        temp = colour_temperature(record.temperature)
+        wind = f"{record.wind_speed} Km/h {record.wind_dir}"
+        humidity = f"{record.humidity}{PERCENT_SIGN}"
+        place = ", ".join(part for part in (record.name, record.country) if part)
+        output = (
+            f"{place}: {record.description}, {temp}, Humidity {humidity}, Wind: {wind}"
+        )
+        if record.note:
+            output += f" ({ircutils.bold(record.note)})"
+        return output
+
+    def format_many(self, locations: list[str], results: list) -> str:
+        """Join the results of a multi-location lookup into one reply."""
+        entries = []
+        for location, data in zip(locations, results):
+            if isinstance(data, Exception):
+                log.error(f"Error: {data} | Context: Weather Command ({location})")
+                entries.append(f"{location}: {data}")
+            else:
+                entries.append(self.format_compact_output(data))
+        return " | ".join(entries)
+
+    def format_coordinates(self, record: Observation) -> str:
         """Format location coordinates."""
-        lon, lat = dd2dms(float(location["lon"]), float(location["lat"]))
+        lon, lat = dd2dms(record.lon, record.lat)
         return f"Lat: {lat}, Lon: {lon}"
 
-    def format_current_conditions(self, current: dict) -> str:
+    def format_current_conditions(self, record: Observation) -> str:
         """Format current weather conditions."""
-        description = re.sub(r"[^\w\s]", "", str(current["weather_descriptions"]))
-        temp = colour_temperature(current["temperature"])
-        feels_like = colour_temperature(current["feelslike"])
-        wind = f"{current['wind_speed']} Km/h {current['wind_dir']}"
-        humidity = f"Humidity {current['humidity']}{PERCENT_SIGN}"
-        precip = f"Precip: {current['precip']} mm/h"
-        uvi = colour_uvi(current["uv_index"])
-        return f"{description}, {humidity}, {precip}, Temp: {temp}, Feels like: {feels_like}, Wind: {wind}, {uvi}"
+        temp = colour_temperature(record.temperature)
+        feels_like = colour_temperature(record.feelslike)
+        wind = f"{record.wind_speed} Km/h {record.wind_dir}"
+        humidity = f"Humidity {record.humidity}{PERCENT_SIGN}"
+        precip = f"Precip: {record.precip} mm/h"
+        uvi = colour_uvi(record.uv_index)
+        return f"{record.description}, {humidity}, {precip}, Temp: {temp}, Feels like: {feels_like}, Wind: {wind}, {uvi}"
 
     ### IRC Command ###
     @wrap(["text"])
     def weather(self, irc, msg, args, location: str):
-        """Get weather information for a town or city."""
+        """<location>[; <location> ...]
+
+        Get weather information for a town, city or postcode. Separate
+        several locations with ';' to get them all in one reply.
+        """
         # Not 'enabled' in #channel.
         if not self.registryValue("enabled", msg.channel, irc.network):
             return
 
-        if not location:
+        locations = [self._normalizer.canonical(part) for part in location.split(";")]
+        locations = [part for part in locations if part]
+        if not locations:
             irc.error("Specify a valid location (e.g., 'Ballarat, AU' or '3350, AU').")
             return
-        location = location.lower()
+        if len(locations) > self.registryValue("maxLocations"):
+            irc.error(
+                f"Too many locations, the limit is {self.registryValue('maxLocations')}."
+            )
+            return
+        wait = self._charge_budgets(irc, msg, len(locations))
+        if wait:
+            irc.error(f"Slow down, try again in {math.ceil(wait)} seconds.")
+            return
+        if len(locations) == 1:
+            lookup = lambda: self.lookup_weather(locations[0])
+            render = self.format_weather_output
+        else:
+            lookup = lambda: self.lookup_many(locations)
+            render = lambda results: self.format_many(locations, results)
+        # Never block the bot's main loop: reply when the lookup completes.
+        admission = self._admission
+        admission.concurrency = self.registryValue("maxConcurrentLookups")
+        admission.depth = self.registryValue("maxQueuedLookups")
+        timeout = self.registryValue("commandTimeout")
+        future = admission.submit(
+            tuple(self._cache_key(location) for location in locations),
+            lambda: self._runtime.submit(
+                with_timeout(self._admitted(lookup), timeout, "Weather lookup")
+            ),
+        )
+        if future is None:
+            irc.error("Busy, try again in a moment.")
+            return
+        future.add_done_callback(lambda f: self._reply_when_done(irc, f, render))
+
+    async def _admitted(self, lookup):
+        """Run a lookup once the admission queue gives it a slot."""
+        with self._metrics.time("queue"):
+            await self._admission.acquire()
         try:
-            if contains_number(location):
-                lat, lon = asyncio.run(self.query_postal_code(location))
-                location = asyncio.run(self.get_location_by_coordinates(lat, lon))
-            data = asyncio.run(self.fetch_weather(location))
-            result = self.format_weather_output(data)
-            irc.reply(result, prefixNick=False)
+            return await lookup()
+        finally:
+            self._admission.release()
+
+    def _reply_when_done(self, irc, future, render):
+        """Completion callback for weather lookups; runs on the event loop."""
+        try:
+            result = future.result()
+            with self._metrics.time("format"):
+                reply = render(result)
+            irc.reply(reply, prefixNick=False)
+        except callbacks.Error as e:
+            log.error(f"Error: {e} | Context: Weather Command")
+            irc.error(str(e))
         except Exception as e:
-            handle_error(e, "Weather Command")
+            log.error(f"Error: {e} | Context: Weather Command")
+            irc.error(f"An error occurred: {e}")
+
+    @wrap(["op", "text"])
+    def subscribe(self, irc, msg, args, channel, location: str):
+        """[<channel>] <location>[; <location> ...]
+
+        Announces the weather for the locations in <channel> every
+        subscriptionInterval seconds. <channel> is only necessary if the
+        message isn't sent in the channel itself.
+        """
+        group = conf.supybot.plugins.Weatherstack.subscriptions.getSpecific(
+            irc.network, channel
+        )
+        subscriptions = list(group())
+        for part in location.split(";"):
+            part = self._normalizer.canonical(part)
+            if part and part not in subscriptions:
+                subscriptions.append(part)
+        limit = self.registryValue("maxSubscriptions", channel, irc.network)
+        if len(subscriptions) > limit:
+            irc.error(f"Too many subscriptions, the limit is {limit}.")
+            return
+        group.setValue(subscriptions)
+        irc.replySuccess()
+
+    @wrap(["op", "text"])
+    def unsubscribe(self, irc, msg, args, channel, location: str):
+        """[<channel>] <location>[; <location> ...]
+
+        Stops announcing the weather for the locations in <channel>.
+        <channel> is only necessary if the message isn't sent in the channel
+        itself.
+        """
+        group = conf.supybot.plugins.Weatherstack.subscriptions.getSpecific(
+            irc.network, channel
+        )
+        remove = {self._normalizer.canonical(part) for part in location.split(";")}
+        subscriptions = [part for part in group() if part not in remove]
+        if len(subscriptions) == len(group()):
+            irc.error(f"{channel} is not subscribed to that.")
+            return
+        group.setValue(subscriptions)
+        irc.replySuccess()
+
+    @wrap(["channel"])
+    def subscriptions(self, irc, msg, args, channel):
+        """[<channel>]
+
+        Lists the locations whose weather is announced in <channel>.
+        <channel> is only necessary if the message isn't sent in the channel
+        itself.
+        """
+        subscriptions = self.registryValue("subscriptions", channel, irc.network)
+        if not subscriptions:
+            irc.reply(f"{channel} has no weather subscriptions.")
+            return
+        interval = self.registryValue("subscriptionInterval") // 60
+        irc.reply(f"Every {interval} minutes in {channel}: {'; '.join(subscriptions)}")
+
+    @wrap(["owner"])
+    def weatherstats(self, irc, msg, args):
+        """takes no arguments
+
+        Shows per-stage lookup latency and the cache, coalescing, rate
+        limiting and quota counters.
+        """
+        counters = self._counters()
+        counters.update(self._gauges())
+        irc.reply(self._metrics.summary(counters), prefixNick=False)
 
 
 Class = Weatherstack
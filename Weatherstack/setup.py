@@ -35,6 +35,8 @@ plugin_setup(
     install_requires=[
         "aiohttp",
         "asyncio",
+        "iso3166",
         "pgeocode",
     ],
+    package_data={"": ["local/*.tsv.gz"]},
 )
@@ -0,0 +1,777 @@
+###
+# Copyright (c) 2021 - 2024, Barry Suridge
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+from supybot import conf, registry
+
+import asyncio
+
+import os
+import threading
+import time
+
+from supybot.test import *
+
+from .local.admission import Admission
+from .local.breaker import CircuitBreaker
+from .local.cache import TTLCache
+from .local import geohash
+from .local.geocache import GeoCache
+from .local.normalize import LocationNormalizer
+from .local.popularity import DecayedCounter
+from .local.postcodes import NominatimRegistry
+from .local.ratelimit import Quota, RequestLimiter
+from .local.records import Observation
+from .local.reverse import ReverseGeocoder
+from .local.runtime import AsyncRuntime, SingleFlight
+from .local.shared import CacheBackend, SQLiteBackend, open_backend
+from .local import snapshot
+from .local.stats import Histogram, Metrics
+
+SAMPLE = {
+    "location": {
+        "name": "Ballarat",
+        "region": "Victoria",
+        "country": "Australia",
+        "lat": "-37.567",
+        "lon": "143.850",
+        "localtime": "2025-01-08 12:05",
+    },
+    "current": {
+        "temperature": 27,
+        "feelslike": 26,
+        "weather_descriptions": ["Sunny"],
+        "wind_speed": 12,
+        "wind_dir": "N",
+        "humidity": 33,
+        "precip": 0,
+        "uv_index": 11,
+    },
+}
+
+
+def sample(name):
+    """A copy of SAMPLE for another town."""
+    return {
+        "location": dict(SAMPLE["location"], name=name.title()),
+        "current": SAMPLE["current"],
+    }
+
+
+class TTLCacheTestCase(SupyTestCase):
+    def testFreshStaleAndExpired(self):
+        now = [0.0]
+        cache = TTLCache(maxsize=2, ttl=10, stale=20, clock=lambda: now[0])
+        self.assertIsNone(cache.lookup("ballarat"))
+        cache.set("ballarat", "sunny")
+        self.assertEqual(cache.lookup("ballarat"), ("sunny", True))
+        now[0] = 15
+        self.assertEqual(cache.lookup("ballarat"), ("sunny", False))
+        now[0] = 30
+        self.assertIsNone(cache.lookup("ballarat"))
+        self.assertEqual((cache.hits, cache.stale_hits, cache.misses), (1, 1, 2))
+        self.assertNotIn("ballarat", cache)
+        self.assertEqual(cache.last("ballarat"), ("sunny", 30))
+
+    def testLeastRecentlyUsedEviction(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.lookup("a")
+        cache.set("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+
+class CircuitBreakerTestCase(SupyTestCase):
+    def testTripAndRecover(self):
+        now = [0.0]
+        breaker = CircuitBreaker("Weatherstack", 2, 10, clock=lambda: now[0])
+        for _ in range(2):
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+        now[0] = 10
+        # One trial request at a time while half-open.
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual((breaker.state, breaker.retry_after()), ("open", 10))
+        now[0] = 20
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual((breaker.trips, breaker.rejected), (2, 2))
+
+
+class DecayedCounterTestCase(SupyTestCase):
+    def testDecayAndEviction(self):
+        now = [0.0]
+        counter = DecayedCounter(halflife=10, maxsize=4, clock=lambda: now[0])
+        for _ in range(4):
+            counter.hit("ballarat", "Ballarat, AU")
+        now[0] = 10
+        counter.hit("london", "London, GB")
+        self.assertAlmostEqual(counter.score("ballarat"), 2.0)
+        self.assertEqual([key for key, _, _ in counter.top(5)], ["ballarat", "london"])
+        now[0] = 30
+        # Both have decayed below the default minimum score of 1.
+        self.assertEqual(counter.top(5), [])
+        for town in ("a", "b", "c"):
+            counter.hit(town)
+        self.assertEqual(len(counter), 4)
+        self.assertNotIn("london", counter)
+
+
+class ObservationTestCase(SupyTestCase):
+    def testDecode(self):
+        record = Observation.from_weatherstack(SAMPLE)
+        self.assertEqual(
+            (record.name, record.lat, record.localtime, record.description),
+            ("Ballarat", -37.567, "08-01-2025 12:05", "Sunny"),
+        )
+        self.assertFalse(hasattr(record, "__dict__"))
+        stale = record.with_note("Stale")
+        self.assertEqual((stale.note, record.note), ("Stale", None))
+
+    def testDecodeOpenWeather(self):
+        record = Observation.from_openweather(
+            {
+                "coord": {"lon": 143.85, "lat": -37.57},
+                "weather": [{"description": "clear sky"}],
+                "main": {"temp": 26.6, "feels_like": 25.9, "humidity": 33},
+                "wind": {"speed": 3.3, "deg": 350},
+                "dt": 1736298300,
+                "timezone": 39600,
+                "sys": {"country": "AU"},
+                "name": "Ballarat",
+            }
+        )
+        self.assertEqual(
+            (record.temperature, record.wind_speed, record.wind_dir),
+            (27, 12, "N"),
+        )
+        self.assertEqual(
+            (record.description, record.localtime), ("Clear sky", "08-01-2025 12:05")
+        )
+
+
+class LocationNormalizerTestCase(SupyTestCase):
+    def testCanonical(self):
+        normalizer = LocationNormalizer()
+        for location in (
+            "Ballarat, AU",
+            "ballarat au",
+            "Ballarat,AU ",
+            "ballarat, australia",
+            "Ballarat,  AUS.",
+        ):
+            self.assertEqual(normalizer.canonical(location), "ballarat, au")
+        self.assertEqual(normalizer.canonical("London UK"), "london, gb")
+        self.assertEqual(normalizer.canonical("St. Albans, England"), "st albans, gb")
+        # Punctuation inside a word does not split it.
+        self.assertEqual(normalizer.canonical("St. John's, CA"), "st johns, ca")
+        self.assertEqual(
+            normalizer.canonical("Stratford-upon-Avon, UK"), "stratford-upon-avon, gb"
+        )
+        self.assertEqual(normalizer.canonical("Bissau, Guinea Bissau"), "bissau, gw")
+        self.assertEqual(normalizer.canonical("Bissau, Guinea-Bissau"), "bissau, gw")
+        # Regions only count as countries after a comma.
+        self.assertEqual(normalizer.canonical("New South Wales"), "new south wales")
+        # Nor do country names that are part of the place.
+        for location in (
+            "New Jersey",
+            "New Mexico",
+            "Western Australia",
+            "Northern Ireland",
+        ):
+            self.assertEqual(normalizer.canonical(location), location.lower())
+        self.assertEqual(
+            normalizer.canonical("Belfast, Northern Ireland"), "belfast, gb"
+        )
+        self.assertEqual(normalizer.canonical("Atlanta, Georgia"), "atlanta, georgia")
+        self.assertEqual(normalizer.canonical("3350 AU"), "3350, au")
+
+    def testAliases(self):
+        normalizer = LocationNormalizer(maxaliases=1)
+        place = normalizer.learn("ballarat au", "Ballarat, Victoria, Australia")
+        self.assertEqual(place, "ballarat, victoria, au")
+        self.assertEqual(normalizer.key("Ballarat, Australia"), place)
+        normalizer.learn("london", "London, City of London, Greater London, UK")
+        self.assertEqual(normalizer.key("ballarat au"), "ballarat, au")
+        self.assertEqual(normalizer.alias_hits, 1)
+
+
+class SnapshotTestCase(SupyTestCase):
+    def testSaveAndLoad(self):
+        now = [100.0]
+        clock = lambda: now[0]
+        filename = conf.supybot.directories.data.dirize("test-snapshot.jsonl.gz")
+        weather = TTLCache(ttl=10, stale=20, clock=clock)
+        normalizer = LocationNormalizer()
+        popular = DecayedCounter(clock=clock)
+        record = Observation.from_weatherstack(SAMPLE)
+        weather.set("ballarat, victoria, au", record)
+        now[0] = 105.0
+        normalizer.learn("ballarat au", "Ballarat, Victoria, Australia")
+        popular.hit("ballarat, victoria, au", "ballarat, au")
+        self.assertEqual(snapshot.save(filename, weather, normalizer, popular), 3)
+
+        weather = TTLCache(ttl=10, stale=20, clock=clock)
+        normalizer = LocationNormalizer()
+        popular = DecayedCounter(clock=clock)
+        self.assertEqual(snapshot.load(filename, weather, normalizer, popular), 3)
+        restored, age = weather.last("ballarat, victoria, au")
+        self.assertEqual(restored.fields(), record.fields())
+        # Plus the moment the snapshot spent on disk.
+        self.assertAlmostEqual(age, 5.0, delta=1)
+        self.assertEqual(normalizer.key("Ballarat, AU"), "ballarat, victoria, au")
+        self.assertAlmostEqual(popular.score("ballarat, victoria, au"), 1.0)
+        self.assertEqual(
+            snapshot.load(filename, weather, normalizer, popular, lambda: True), 0
+        )
+
+
+class SharedCacheTestCase(SupyTestCase):
+    def testLeases(self):
+        filename = conf.supybot.directories.data.dirize("test-shared.db")
+        first, second = open_backend(f"sqlite:{filename}"), SQLiteBackend(filename)
+        try:
+            self.assertTrue(first.acquire("ballarat, au", "bot1", 60))
+            self.assertFalse(second.acquire("ballarat, au", "bot2", 60))
+            first.put("ballarat, au", ["Ballarat"])
+            fields, age = second.get("ballarat, au")
+            self.assertEqual(fields, ["Ballarat"])
+            first.release("ballarat, au", "bot1")
+            self.assertTrue(second.acquire("ballarat, au", "bot2", -1))
+            # An expired lease can be taken over.
+            self.assertTrue(first.acquire("ballarat, au", "bot1", 60))
+        finally:
+            first.close()
+            second.close()
+        self.assertRaises(ValueError, open_backend, "redis:localhost")
+
+    def testIncompleteBackend(self):
+        class Backend(CacheBackend):
+            def get(self, key):
+                return None
+
+        self.assertRaises(TypeError, Backend)
+
+
+class GeohashTestCase(SupyTestCase):
+    def testEncodeAndCentre(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        cell = geohash.encode(-37.56, 143.85, 5)
+        lat, lon = geohash.centre(cell)
+        self.assertEqual(geohash.encode(lat, lon, 5), cell)
+        self.assertLess(abs(lat + 37.56) + abs(lon - 143.85), 0.05)
+
+
+class GeoCacheTestCase(SupyTestCase):
+    def testPostcodesAndPlaces(self):
+        geocache = GeoCache(":memory:")
+        self.assertIsNone(geocache.get_postcode("3350", "au"))
+        geocache.set_postcode("3350", "au", -37.5622, 143.8503)
+        self.assertEqual(geocache.get_postcode("3350", "AU"), (-37.5622, 143.8503))
+        geocache.set_place(-37.5622, 143.8503, "Ballarat, Victoria, AU")
+        # Nearby coordinates round onto the same cached place.
+        self.assertEqual(
+            geocache.get_place(-37.56221, 143.85029), "Ballarat, Victoria, AU"
+        )
+        self.assertIsNone(geocache.get_place(-37.6, 143.8503))
+        geocache.close()
+
+
+class NominatimRegistryTestCase(SupyTestCase):
+    def testLoadsOncePerCountryAndEvicts(self):
+        loads = []
+
+        class Registry(NominatimRegistry):
+            def _load(self, country):
+                loads.append(country)
+                return object()
+
+        registry = Registry(maxsize=2)
+        self.assertIs(registry.get("au"), registry.get("AU"))
+        registry.preload(["GB", "NZ"])
+        self.assertEqual(loads, ["AU", "GB", "NZ"])
+        self.assertNotIn("AU", registry)
+        self.assertIn("NZ", registry)
+
+
+class SingleFlightTestCase(SupyTestCase):
+    def testConcurrentCallersShareOneCall(self):
+        runtime = AsyncRuntime()
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "sunny"
+
+        async def burst():
+            return await asyncio.gather(
+                *(flights.do("ballarat", fetch) for _ in range(10))
+            )
+
+        try:
+            self.assertEqual(runtime.run(burst()), ["sunny"] * 10)
+        finally:
+            runtime.close()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.coalesced, 9)
+        self.assertEqual(len(flights), 0)
+
+
+class AdmissionTestCase(SupyTestCase):
+    def testQueueAndShed(self):
+        runtime = AsyncRuntime()
+        admission = Admission(concurrency=2, depth=1)
+        running = []
+
+        async def work(n):
+            await admission.acquire()
+            try:
+                running.append(admission.running)
+                await asyncio.sleep(0.05)
+                return n
+            finally:
+                admission.release()
+
+        try:
+            futures = [
+                admission.submit(n, lambda n=n: runtime.submit(work(n)))
+                for n in range(4)
+            ]
+            self.assertIsNone(futures[3])
+            self.assertIs(admission.submit(0, None), futures[0])
+            self.assertEqual([f.result(5) for f in futures[:3]], [0, 1, 2])
+        finally:
+            runtime.close()
+        self.assertLessEqual(max(running), 2)
+        self.assertEqual((admission.shed, admission.merged), (1, 1))
+        self.assertEqual((admission.running, len(admission)), (0, 0))
+
+
+class RateLimitTestCase(SupyTestCase):
+    def testRequestBudgetsChargeAllOrNothing(self):
+        now = [0.0]
+        limiter = RequestLimiter(clock=lambda: now[0])
+        budgets = [("global", 10), ("user", 2)]
+        self.assertEqual(limiter.charge(budgets), 0)
+        self.assertEqual(limiter.charge(budgets), 0)
+        self.assertAlmostEqual(limiter.charge(budgets), 30)
+        # The refused request did not spend the global budget.
+        self.assertEqual(limiter.charge([("global", 10)], 8), 0)
+        now[0] = 30
+        self.assertEqual(limiter.charge([("user", 2)]), 0)
+
+    def testMonthlyQuota(self):
+        quota = Quota("Weatherstack")
+        quota.configure(0, 2)
+        self.assertTrue(quota.acquire())
+        self.assertTrue(quota.acquire())
+        self.assertFalse(quota.acquire())
+        self.assertEqual((quota.remaining, quota.denied), (0, 1))
+
+    def testQuotaCost(self):
+        now = [0.0]
+        quota = Quota("Weatherstack", clock=lambda: now[0])
+        quota.configure(2, 10)
+        self.assertTrue(quota.acquire(3))
+        self.assertFalse(quota.acquire())
+        now[0] = 1.0
+        self.assertTrue(quota.acquire(6))
+        self.assertFalse(quota.acquire(2))
+        self.assertEqual((quota.used, quota.remaining, quota.denied), (9, 1, 2))
+
+
+class ReverseGeocoderTestCase(SupyTestCase):
+    def testNearestPlace(self):
+        geocoder = ReverseGeocoder(
+            os.path.join(os.path.dirname(__file__), "local", "cities15000.tsv.gz"),
+            conf.supybot.directories.data.dirize("test-cities.kdtree"),
+        )
+        try:
+            label, distance = geocoder.nearest(-37.5622, 143.8503)
+            self.assertEqual(label, "Ballarat, Victoria, AU")
+            self.assertLess(distance, 5)
+            # Across the antimeridian.
+            label, distance = geocoder.nearest(-18.14, -179.99)
+            self.assertTrue(label.endswith("FJ"), label)
+        finally:
+            geocoder.close()
+
+
+class MetricsTestCase(SupyTestCase):
+    def testHistogram(self):
+        hist = Histogram()
+        for ms in (0.5, 3, 3, 40, 20000):
+            hist.observe(ms)
+        self.assertEqual(hist.percentile(50), 5)
+        self.assertEqual(hist.percentile(80), 50)
+        self.assertEqual(hist.percentile(100), float("inf"))
+
+    def testPrometheus(self):
+        metrics = Metrics()
+        with metrics.time("weatherstack"):
+            pass
+        text = metrics.prometheus({"cache_hits": 2}, {"cache_entries": 1})
+        self.assertIn(
+            'weatherstack_stage_latency_seconds_count{stage="weatherstack"} 1', text
+        )
+        self.assertIn("weatherstack_cache_hits_total 2", text)
+        self.assertIn("weatherstack_cache_entries 1", text)
+        self.assertIn("weatherstack: n=1", metrics.summary({}))
+
+
+class WeatherstackTestCase(PluginTestCase):
+    plugins = ("Weatherstack",)
+
+    def testDisabledByDefault(self):
+        self.assertNoResponse("weather Ballarat, AU", timeout=1)
+
+    def testSharedSession(self):
+        cb = self.irc.getCallback("Weatherstack")
+
+        async def session_id():
+            return id(cb._runtime.session)
+
+        self.assertEqual(cb._runtime.run(session_id()), cb._runtime.run(session_id()))
+
+    def testPostcodeRegistry(self):
+        cb = self.irc.getCallback("Weatherstack")
+        self.assertEqual(type(cb._nominatim).__name__, "NominatimRegistry")
+
+
+class WeatherstackCommandTestCase(PluginTestCase):
+    plugins = ("Weatherstack",)
+    config = {"supybot.plugins.Weatherstack.enabled": True}
+
+    def setUp(self):
+        super().setUp()
+        self.cb = self.irc.getCallback("Weatherstack")
+        self.queries = []
+
+        async def fetch_weather_upstream(location):
+            self.queries.append(location)
+            return Observation.from_weatherstack(sample(location.split(",")[0]))
+
+        self.cb.fetch_weather_upstream = fetch_weather_upstream
+
+    def testWeather(self):
+        self.assertRegexp("weather Ballarat, AU", "Ballarat, Victoria, Australia")
+        self.assertRegexp("weather Ballarat, AU", "Sunny")
+        self.assertEqual(self.queries, ["ballarat, au"])
+
+    def testEquivalentLocationsShareCache(self):
+        self.assertNotError("weather Ballarat, AU")
+        self.assertNotError("weather ballarat au")
+        # Learned from the first answer.
+        self.assertNotError("weather Ballarat, Victoria, Australia")
+        self.assertEqual(self.queries, ["ballarat, au"])
+
+    def testMultipleLocations(self):
+        self.assertRegexp(
+            "weather Ballarat, AU; London, GB", r"Ballarat, Australia: .* \| London"
+        )
+        self.assertError("weather a; b; c; d; e; f")
+
+    def testPostcode(self):
+        class Postcodes:
+            def query_postal_code(self, postcode):
+                return type("Row", (), {"latitude": -37.56, "longitude": 143.85})
+
+        class Registry(NominatimRegistry):
+            def _load(self, country):
+                return Postcodes()
+
+        self.cb._nominatim = Registry()
+        geocode = []
+
+        async def get_location_by_coordinates(lat, lon):
+            geocode.append((lat, lon))
+            return "Ballarat, Victoria, AU"
+
+        self.cb.get_location_by_coordinates = get_location_by_coordinates
+        self.assertRegexp("weather 3350, AU", r"^Ballarat, Victoria, AU \|")
+        self.assertEqual(geocode, [(-37.56, 143.85)])
+        # Looked up by the centre of the postcode's geohash cell.
+        self.assertEqual(self.queries, ["-37.5513,143.8550"])
+        with conf.supybot.plugins.Weatherstack.geohashPrecision.context(0):
+            self.assertRegexp("weather 3352, AU", "Ballarat, Victoria, Australia")
+        self.assertEqual(self.queries[1:], ["Ballarat, Victoria, AU"])
+
+    def testPostcodeFallback(self):
+        async def query_postal_code(code):
+            return -37.56, 143.85
+
+        async def get_location_by_coordinates(lat, lon):
+            return "Ballarat, Victoria, AU"
+
+        get_json, requests = self.cb._get_json, []
+
+        async def fake_get_json(api, stage, url, params, action, cost=1):
+            if api != "openweather":
+                return await get_json(api, stage, url, params, action, cost)
+            requests.append(params)
+            return {
+                "coord": {"lon": 143.85, "lat": -37.55},
+                "weather": [{"description": "clear sky"}],
+                "main": {"temp": 26.6, "feels_like": 25.9, "humidity": 33},
+                "dt": 1736298300,
+                "sys": {"country": "AU"},
+                "name": "Ballarat",
+            }
+
+        self.cb.query_postal_code = query_postal_code
+        self.cb.get_location_by_coordinates = get_location_by_coordinates
+        self.cb._get_json = fake_get_json
+        del self.cb.fetch_weather_upstream
+        for _ in range(5):
+            self.cb._breakers["weatherstack"].failure()
+        with conf.supybot.plugins.Weatherstack.weatherstackAPI.context(
+            "key"
+        ), conf.supybot.plugins.Weatherstack.openweatherAPI.context(
+            "key"
+        ), conf.supybot.plugins.Weatherstack.weatherFallback.context(
+            True
+        ):
+            self.assertRegexp("weather 3350, AU", "Clear sky.*via OpenWeatherMap")
+        self.assertEqual(len(requests), 1)
+        self.assertNotIn("q", requests[0])
+        self.assertEqual(
+            (requests[0]["lat"], requests[0]["lon"]), ("-37.5513", "143.8550")
+        )
+
+    def testNearbyPostcodesShareCell(self):
+        places = {"3350": (-37.56, 143.86), "3355": (-37.545, 143.84)}
+
+        async def query_postal_code(code):
+            return places[code.split(",")[0]]
+
+        async def get_location_by_coordinates(lat, lon):
+            return "Ballarat Central" if lon > 143.85 else "Wendouree"
+
+        self.cb.query_postal_code = query_postal_code
+        self.cb.get_location_by_coordinates = get_location_by_coordinates
+        self.assertRegexp("weather 3350, AU", "^Ballarat Central")
+        self.assertRegexp("weather 3355, AU", "^Wendouree")
+        self.assertEqual(len(self.queries), 1)
+
+    def testSlowUpstreamTimesOut(self):
+        async def fetch_weather_upstream(location):
+            await asyncio.sleep(5)
+
+        self.cb.fetch_weather_upstream = fetch_weather_upstream
+        with conf.supybot.plugins.Weatherstack.weatherTimeout.context(0.1):
+            self.assertRegexp("weather Ballarat, AU", "timed out")
+
+    def testUserBudget(self):
+        with conf.supybot.plugins.Weatherstack.userRequestsPerMinute.context(2):
+            self.assertNotError("weather Ballarat, AU")
+            self.assertNotError("weather Ballarat, AU")
+            self.assertRegexp("weather Ballarat, AU", "Slow down")
+
+    def testOpenBreakerAnswersFromStaleCache(self):
+        self.assertNotError("weather Ballarat, AU")
+        # Use the real upstream call, behind a tripped breaker.
+        del self.cb.fetch_weather_upstream
+        for _ in range(5):
+            self.cb._breakers["weatherstack"].failure()
+        with conf.supybot.plugins.Weatherstack.weatherstackAPI.context("key"):
+            self.assertRegexp("weather London, GB", "Weatherstack API is unavailable")
+            # Age the cached Ballarat entry past its stale window.
+            cache = self.cb._weather_cache
+            clock = cache._clock
+            cache._clock = lambda: clock() + 3000
+            self.assertRegexp(
+                "weather Ballarat, AU", "Sunny.*Stale: observed 50 min ago"
+            )
+
+    def testPrefetchPopular(self):
+        self.assertNotError("weather Ballarat, AU")
+        self.assertNotError("weather Ballarat, AU")
+        self.assertNotError("weather London, GB")
+
+        async def prefetch():
+            return self.cb._prefetch_once()
+
+        with conf.supybot.plugins.Weatherstack.prefetchSize.context(1):
+            # Nothing is about to expire yet.
+            self.assertEqual(self.cb._runtime.run(prefetch()), 0)
+            cache = self.cb._weather_cache
+            clock = cache._clock
+            cache._clock = lambda: clock() + 580
+            with conf.supybot.plugins.Weatherstack.weatherstackMonthlyQuota.context(10):
+                # Within the 20% left for users.
+                self.cb._quotas["weatherstack"].used = 8
+                self.assertEqual(self.cb._runtime.run(prefetch()), 0)
+                self.cb._quotas["weatherstack"].used = 0
+                self.assertEqual(self.cb._runtime.run(prefetch()), 1)
+        self.cb._runtime.run(asyncio.sleep(0.1))
+        self.assertEqual(self.queries, ["ballarat, au", "london, gb", "ballarat, au"])
+
+    def testSnapshotAcrossReload(self):
+        self.assertNotError("weather Ballarat, AU")
+        self.cb._save_snapshot()
+        self.cb._weather_cache.clear()
+        self.cb._normalizer = LocationNormalizer()
+        self.cb._runtime.run(self.cb._restore_snapshot())
+        self.assertNotError("weather Ballarat, Australia")
+        self.assertEqual(self.queries, ["ballarat, au"])
+
+    def testBulkQueryChargedPerLocation(self):
+        quota = self.cb._quotas["weatherstack"]
+        with conf.supybot.plugins.Weatherstack.weatherstackAPI.context(
+            "key"
+        ), conf.supybot.plugins.Weatherstack.weatherstackMonthlyQuota.context(2):
+            with self.assertRaises(callbacks.Error):
+                self.cb._runtime.run(
+                    self.cb.fetch_weather_bulk(["ballarat, au", "london, gb", "paris"])
+                )
+        self.assertEqual((quota.used, quota.denied), (0, 1))
+
+    def testSharedCache(self):
+        filename = conf.supybot.directories.data.dirize("test-shared-plugin.db")
+        other = SQLiteBackend(filename)
+        threads = set()
+
+        class Backend(SQLiteBackend):
+            def get(self, key):
+                threads.add(threading.current_thread())
+                return super().get(key)
+
+            def put(self, key, fields):
+                threads.add(threading.current_thread())
+                super().put(key, fields)
+
+        self.cb._shared = Backend(filename)
+        try:
+            # Another bot already fetched London.
+            other.put(
+                "london, gb", Observation.from_weatherstack(sample("London")).fields()
+            )
+            self.assertRegexp("weather London, GB", "London, Victoria")
+            self.assertNotError("weather Ballarat, AU")
+            self.assertEqual(self.queries, ["ballarat, au"])
+            self.assertIsNotNone(other.get("ballarat, victoria, au"))
+            # Released once the fetch was done.
+            self.assertTrue(other.acquire("ballarat, au", "other", 60))
+            # Never blocking the event loop.
+            self.assertTrue(threads)
+            self.assertNotIn(self.cb._runtime._thread, threads)
+        finally:
+            self.cb._shared.close()
+            self.cb._shared = None
+            other.close()
+
+    def testBusy(self):
+        async def fetch_weather_upstream(location):
+            await asyncio.sleep(0.5)
+            return Observation.from_weatherstack(sample(location.split(",")[0]))
+
+        self.cb.fetch_weather_upstream = fetch_weather_upstream
+        with conf.supybot.plugins.Weatherstack.maxConcurrentLookups.context(1):
+            with conf.supybot.plugins.Weatherstack.maxQueuedLookups.context(0):
+                self.irc.feedMsg(
+                    ircmsgs.privmsg(
+                        self.nick, "weather Ballarat, AU", prefix=self.prefix
+                    )
+                )
+                self.assertRegexp("weather London, GB", "Busy")
+                # The same place again joins the lookup in flight.
+                self.assertRegexp("weather ballarat au", "Ballarat")
+                # And both commands get their reply.
+                for _ in range(40):
+                    m = self.irc.takeMsg()
+                    if m is not None:
+                        break
+                    time.sleep(0.05)
+                self.assertIn("Ballarat", m.args[1])
+        self.assertEqual(self.cb._admission.merged, 1)
+
+    def testStats(self):
+        self.assertNotError("weather Ballarat, AU")
+        self.assertRegexp("weatherstats", r"format: n=1 .*cache_misses 1")
+
+
+class WeatherstackSubscriptionTestCase(ChannelPluginTestCase):
+    plugins = ("Weatherstack",)
+    config = {"supybot.plugins.Weatherstack.enabled": True}
+
+    def setUp(self):
+        super().setUp()
+        self.cb = self.irc.getCallback("Weatherstack")
+        self.queries = []
+
+        async def fetch_weather_upstream(location):
+            self.queries.append(location)
+            return Observation.from_weatherstack(sample(location.split(",")[0]))
+
+        self.cb.fetch_weather_upstream = fetch_weather_upstream
+        conf.supybot.plugins.Weatherstack.subscriptions.getSpecific(
+            self.irc.network, self.channel
+        ).setValue([])
+
+    def testSubscribe(self):
+        self.assertNotError("subscribe Ballarat, AU; London, GB")
+        self.assertNotError("subscribe ballarat au")
+        self.assertResponse(
+            "subscriptions",
+            f"Every 30 minutes in {self.channel}: ballarat, au; london, gb",
+        )
+        self.assertNotError("unsubscribe London, GB")
+        self.assertError("unsubscribe London, GB")
+        self.assertRegexp("subscriptions", "ballarat, au$")
+        with conf.supybot.plugins.Weatherstack.maxSubscriptions.context(1):
+            self.assertError("subscribe Sydney, AU")
+
+    def testAnnounce(self):
+        # Learn that both subscriptions are the same place.
+        self.assertNotError("weather Ballarat, AU")
+        self.cb._weather_cache.clear()
+        self.assertNotError("subscribe Ballarat, AU; Ballarat, Victoria, AU")
+        # Both spellings are one place, announced once to the channel.
+        self.assertEqual(self.cb._runtime.run(self.cb._announce_once()), 1)
+        m = self.irc.takeMsg()
+        self.assertEqual(m.args[0], self.channel)
+        self.assertIn("Ballarat, Victoria, Australia", m.args[1])
+        self.assertIsNone(self.irc.takeMsg())
+        self.assertEqual(self.queries, ["ballarat, au", "ballarat, au"])
+
+
+if os.environ.get("WEATHERSTACK_BENCH"):
+    from .bench import WeatherstackBenchmarkCase
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: